@@ -0,0 +1,99 @@
+"""
+JWT authentication trusting the role claims of the access tokens.
+
+The tokens issued by the token/ endpoints carry the is_admin, is_staff,
+is_active and role_version claims of the user. For read-only requests whose
+role_version still matches the user's current role version (kept in the
+cache and bumped whenever their groups, staff or active status change) the
+request user is built from the claims, without loading the user row nor
+its groups. Other requests load the user from the database as usual.
+"""
+
+from functools import cached_property
+from django.contrib.auth import get_user_model
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+from utils.versions import get_resource_version
+from .permissions import ADMIN_GROUP, get_roles_resource, is_admin
+
+ROLE_CLAIMS = ("is_admin", "is_staff", "is_active", "role_version")
+
+
+def add_role_claims(token: Token, user) -> Token:
+    """Add the role claims of the user to a token"""
+    token["role_version"] = get_resource_version(get_roles_resource(user.pk))
+    token["is_admin"] = is_admin(user)
+    token["is_staff"] = user.is_staff
+    token["is_active"] = user.is_active
+    return token
+
+
+def has_current_claims(token: Token) -> bool:
+    """Whether the role claims of a token are present and still up to date"""
+    if any(claim not in token for claim in ROLE_CLAIMS) or not token["is_active"]:
+        return False
+    user_id = token[api_settings.USER_ID_CLAIM]
+    return token["role_version"] == get_resource_version(get_roles_resource(user_id))
+
+
+class ClaimsUser(TokenUser):
+    """
+    User backed by the role claims of a token. Any other attribute is read
+    from the user row, loaded the first time it's needed
+    """
+
+    def __init__(self, token: Token) -> None:
+        super().__init__(token)
+        self.is_active = token["is_active"]
+        self._roles = frozenset([ADMIN_GROUP]) if token["is_admin"] else frozenset()
+
+    @cached_property
+    def id(self):
+        # The claim is a string, the pk has the type of the user model's one
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def user(self):
+        return get_user_model().objects.get(pk=self.pk)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, get_user_model()):
+            return str(self.pk) == str(other.pk)
+        return super().__eq__(other)
+
+    def __hash__(self) -> int:
+        return super().__hash__()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWT authentication building the user of read-only requests from the claims"""
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if request.method in SAFE_METHODS and has_current_claims(validated_token):
+            return ClaimsUser(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+
+class ClaimsJWTScheme(SimpleJWTScheme):
+    """Document ClaimsJWTAuthentication as the usual JWT bearer scheme"""
+
+    target_class = ClaimsJWTAuthentication
+
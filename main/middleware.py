@@ -0,0 +1,101 @@
+"""
+Channels middleware authenticating the websocket connections from a JWT.
+
+The access token is read from the 'token' query string parameter or from the
+subprotocols ('Bearer', <token>), as browsers can't set headers on websocket
+connections. Verified tokens are kept in an in-memory LRU by hash until
+they expire (at most WEBSOCKET_TOKEN_CACHE_TTL seconds), so reconnecting
+clients are authenticated without verifying the token nor loading the user
+again. Connections without a valid token get an AnonymousUser.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import ClaimsJWTAuthentication, ClaimsUser, has_current_claims
+
+SUBPROTOCOL = "Bearer"
+
+
+class TokenCache:
+    """LRU of the users of the verified tokens, by SHA-256 of the whole token"""
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """User of the token, None if it isn't cached or has expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        user, expires = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return user
+
+    def set(self, key, user, expires):
+        self._entries[key] = (user, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+def get_scope_token(scope) -> tuple[str | None, str | None]:
+    """Token of the connection and the subprotocol it came in, if any"""
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if query.get("token"):
+        return query["token"][0], None
+    subprotocols = scope.get("subprotocols") or []
+    if len(subprotocols) >= 2 and subprotocols[0] == SUBPROTOCOL:
+        return subprotocols[1], SUBPROTOCOL
+    return None, None
+
+
+def authenticate_token(raw_token) -> tuple[AccessToken, object]:
+    """Verify the token and get its user, trusting its role claims if current"""
+    token = AccessToken(raw_token)
+    if has_current_claims(token):
+        return token, ClaimsUser(token)
+    return token, ClaimsJWTAuthentication().get_user(token)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Set the scope 'user' from the JWT of the websocket connection"""
+
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.tokens = TokenCache(settings.WEBSOCKET_TOKEN_CACHE_SIZE)
+
+    async def get_user(self, raw_token):
+        # The whole token is hashed, a cached signature alone isn't enough
+        key = hashlib.sha256(raw_token.encode()).hexdigest()
+        user = self.tokens.get(key)
+        if user is None:
+            try:
+                token, user = await database_sync_to_async(authenticate_token)(
+                    raw_token
+                )
+            except (TokenError, AuthenticationFailed):
+                return AnonymousUser()
+            expires = min(token["exp"], time.time() + settings.WEBSOCKET_TOKEN_CACHE_TTL)
+            self.tokens.set(key, user, expires)
+        return user
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token, subprotocol = get_scope_token(scope)
+        scope["user"] = await self.get_user(raw_token) if raw_token else AnonymousUser()
+        if subprotocol:
+            # The consumer has to accept the connection with the same subprotocol
+            scope["auth_subprotocol"] = subprotocol
+        return await super().__call__(scope, receive, send)
@@ -1,4 +1,74 @@
+"""
+Permission classes of the API and the resolution of the user roles they use.
+
+The roles of a user are the names of their groups. They are resolved once per
+request (kept on the user object) and cached across requests by user id and
+a role version stamp, which is bumped whenever the groups, staff or active
+status of the user change (see user.signals), so the permission checks
+don't query the database. The version is also carried by the role claims of
+the access tokens (see main.authentication).
+"""
+
+from django.core.cache import cache
 from rest_framework.permissions import BasePermission, SAFE_METHODS
+from utils.versions import (
+    bump_resource_version,
+    get_resource_version,
+    get_version_key,
+)
+
+ADMIN_GROUP = "admin"
+# Seconds the roles are cached, it bounds the staleness of the changes that
+# skip the model signals (e.g. queryset update())
+ROLES_CACHE_TIMEOUT = 60 * 60
+
+
+def get_roles_resource(user_id) -> str:
+    return f"user_roles_{user_id}"
+
+
+def get_user_roles(user) -> frozenset:
+    """Names of the groups of a user, resolved at most once per request"""
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, "_roles", None)
+    if roles is None:
+        version = get_resource_version(get_roles_resource(user.pk))
+        # The join date tells apart the users of a reused id
+        key = f"roles_{user.pk}_{user.date_joined.timestamp()}_{version}"
+        roles = cache.get(key)
+        if roles is None:
+            roles = frozenset(user.groups.values_list("name", flat=True))
+            cache.set(key, roles, ROLES_CACHE_TIMEOUT)
+        user._roles = roles
+    return roles
+
+
+def is_admin(user) -> bool:
+    """Whether the user is in the admin group"""
+    return ADMIN_GROUP in get_user_roles(user)
+
+
+def invalidate_roles(user_id) -> None:
+    """
+    Discard the cached roles and token claims of a user after changing their
+    groups, staff or active status. The version is bumped right away for the
+    rest of the transaction and again once it commits, discarding the roles
+    read from the database meanwhile
+    """
+    resource = get_roles_resource(user_id)
+    get_resource_version(resource)
+    try:
+        cache.incr(get_version_key(resource))
+    except ValueError:
+        pass
+    bump_resource_version(resource)
+
+
+def invalidate_user_roles(user) -> None:
+    """invalidate_roles() of a user, also dropping the roles kept on the object"""
+    invalidate_roles(user.pk)
+    user.__dict__.pop("_roles", None)
 
 
 class IsActive(BasePermission):
@@ -22,7 +92,7 @@ class IsSameUserOrStaff(BasePermission):
             return False
 
         # Allow staff and admin group users
-        if request.user.is_staff or request.user.groups.filter(name="admin").exists():
+        if request.user.is_staff or is_admin(request.user):
             return True
 
         # Don't allow non-staff users to update their staff, is_admin, or is_active fields
@@ -32,7 +102,7 @@ class IsSameUserOrStaff(BasePermission):
             if (
                 "is_admin" in request.data
                 or "is_active" in request.data
-                and not request.user.groups.filter(name="admin").exists()
+                and not is_admin(request.user)
             ):
                 return False
 
@@ -45,7 +115,7 @@ class IsInAdminGroupOrStaff(BasePermission):
     Custom permission to only allow users in the admin group.
     """
 
-    group_name = "admin"
+    group_name = ADMIN_GROUP
 
     def has_permission(self, request, view):
         # Allow staff users
@@ -53,7 +123,7 @@ class IsInAdminGroupOrStaff(BasePermission):
             return True
 
         # Allow if the user is in the admin group
-        return request.user.groups.filter(name=self.group_name).exists()
+        return self.group_name in get_user_roles(request.user)
 
 
 class AdminWriteAllRead(BasePermission):
@@ -68,7 +138,7 @@ class AdminWriteAllRead(BasePermission):
             return True
 
         # Allow admin users to write
-        return request.user.groups.filter(name="admin").exists()
+        return is_admin(request.user)
 
     def has_object_permission(self, request, view, obj):
         # Allow all users to read
@@ -76,7 +146,7 @@ class AdminWriteAllRead(BasePermission):
             return True
 
         # Allow admin users to write
-        return request.user.groups.filter(name="admin").exists()
+        return is_admin(request.user)
 
 
 class UsersWriteAllRead(BasePermission):
@@ -1,4 +1,12 @@
+from django.contrib.auth import get_user_model
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import add_role_claims
 
 
 class HealthCheckSerializer(serializers.Serializer):
@@ -31,3 +39,24 @@ class LogSerializer(serializers.Serializer):
         instance.user = validated_data.get('user', instance.user)
         instance.action = validated_data.get('action', instance.action)
         return instance
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issue the tokens with the role claims of the user"""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_role_claims(super().get_token(user), user)
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """Issue the refreshed access token with the current role claims of the user"""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = self.token_class(attrs["refresh"])
+        user = get_user_model().objects.get(
+            **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+        )
+        data["access"] = str(add_role_claims(AccessToken(data["access"]), user))
+        return data
@@ -278,12 +278,18 @@ else:
 # REST Framework
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "main.authentication.ClaimsJWTAuthentication",
     ),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DATETIME_INPUT_FORMATS": ["iso-8601", "%Y-%m-%dT%H:%M:%S.%fZ"],
 }
 
+# Simple JWT, the tokens carry the role claims of the user
+SIMPLE_JWT = {
+    "TOKEN_OBTAIN_SERIALIZER": "main.serializers.RoleTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "main.serializers.RoleTokenRefreshSerializer",
+}
+
 # Spectacular
 SPECTACULAR_SETTINGS = {
     "COMPONENT_SPLIT_REQUEST": True,
@@ -292,6 +298,30 @@ SPECTACULAR_SETTINGS = {
 # Frontend
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:5173")
 
+# Seconds the websocket update messages are buffered to be merged, the
+# in-memory channel layer only works from the server event loop
+WEBSOCKET_COALESCE_WINDOW = float(
+    os.environ.get("WEBSOCKET_COALESCE_WINDOW", 0 if DEBUG else 0.05)
+)
+
+# Verified websocket tokens kept in memory by each server process, and the
+# longest time in seconds one is trusted without being verified again
+WEBSOCKET_TOKEN_CACHE_SIZE = 4096
+WEBSOCKET_TOKEN_CACHE_TTL = 60
+
+# Seconds between the application pings to the websocket clients that ask for
+# them (?ping=1), and without any message from one before it is disconnected.
+# Dead peers of every client are detected by the daphne protocol pings
+WEBSOCKET_PING_INTERVAL = float(os.environ.get("WEBSOCKET_PING_INTERVAL", 20))
+WEBSOCKET_IDLE_TIMEOUT = float(os.environ.get("WEBSOCKET_IDLE_TIMEOUT", 60))
+
+# Seconds the online users join/leave diffs are buffered to be sent together
+PRESENCE_BATCH_WINDOW = float(
+    os.environ.get("PRESENCE_BATCH_WINDOW", 0 if DEBUG else 1)
+)
+
 # Supabase
 SUPABASE_URL = os.environ.get("SUPABASE_URL", None)
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY", None)
+# Threads pushing the images to Supabase storage in the background
+IMAGE_UPLOAD_WORKERS = int(os.environ.get("IMAGE_UPLOAD_WORKERS", 2))
@@ -1,6 +1,10 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from rest_framework_simplejwt.tokens import AccessToken
+from main.authentication import ClaimsUser, has_current_claims
+from main.permissions import ADMIN_GROUP, get_user_roles, is_admin
+from user.serializers import UserSerializer
 import logging
 
 transaction_logger = logging.getLogger("transactions")
@@ -123,3 +127,112 @@ class LogsTests(TestCase):
             response.json(),
             {"detail": "'lines' parameter must be non-negative."},
         )
+
+
+class RolesTests(TestCase):
+    """Tests for the resolution of the user roles"""
+
+    def setUp(self) -> None:
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email="diegoDev@tec.mx",
+            password="MyStrongPass123!!!",
+        )
+
+    def test_roles_cache(self):
+        """Test the roles are resolved once and invalidated on updates"""
+        # Test: The roles are read from the database once
+        with self.assertNumQueries(1):
+            self.assertTrue(is_admin(self.admin_user))
+            self.assertEqual(get_user_roles(self.admin_user), {"admin"})
+
+        # Test: Other requests (other user objects) use the cached roles
+        user = get_user_model().objects.get(pk=self.admin_user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_admin(user))
+
+        # Test: Removing the user from the admin group invalidates the roles
+        serializer = UserSerializer(user, data={"is_admin": False}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        user = get_user_model().objects.get(pk=self.admin_user.pk)
+        self.assertFalse(is_admin(user))
+
+    def test_roles_invalidated_outside_the_api(self):
+        """Test the roles follow the changes made with the ORM (e.g. the Django admin)"""
+        group = Group.objects.get(name=ADMIN_GROUP)
+        self.assertTrue(is_admin(self.admin_user))
+
+        # Test: Setting the groups of the user, as the admin change form does
+        self.admin_user.groups.set([])
+        self.assertFalse(is_admin(get_user_model().objects.get(pk=self.admin_user.pk)))
+
+        # Test: Changing the users of the group
+        group.user_set.add(self.admin_user)
+        self.assertTrue(is_admin(get_user_model().objects.get(pk=self.admin_user.pk)))
+        group.user_set.clear()
+        self.assertFalse(is_admin(get_user_model().objects.get(pk=self.admin_user.pk)))
+
+        # Test: Demoting the user invalidates the claims of their tokens
+        group.user_set.add(self.admin_user)
+        access_token = self.client.post(
+            "/token/",
+            {"email": "diegoDev@tec.mx", "password": "MyStrongPass123!!!"},
+        ).json()["access"]
+        self.admin_user.is_staff = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin_user.save()
+        self.assertFalse(has_current_claims(AccessToken(access_token)))
+
+        # Test: Saving other fields keeps the claims
+        access_token = self.client.post(
+            "/token/",
+            {"email": "diegoDev@tec.mx", "password": "MyStrongPass123!!!"},
+        ).json()["access"]
+        self.admin_user.theme = "dark"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin_user.save(update_fields=["theme"])
+        self.assertTrue(has_current_claims(AccessToken(access_token)))
+
+    def test_token_role_claims(self):
+        """Test the tokens carry the role claims trusted by read-only requests"""
+        response = self.client.post(
+            "/token/",
+            {"email": "diegoDev@tec.mx", "password": "MyStrongPass123!!!"},
+        )
+        tokens = response.json()
+        access_token = AccessToken(tokens["access"])
+        self.assertTrue(access_token["is_admin"])
+        self.assertTrue(access_token["is_staff"])
+        self.assertTrue(access_token["is_active"])
+
+        # Test: A read-only request needs neither the user nor their groups
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/logs/", HTTP_AUTHORIZATION=f"Bearer {tokens['access']}"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ClaimsUser(access_token), self.admin_user)
+
+        # Test: Deactivating the user invalidates the claims
+        serializer = UserSerializer(
+            self.admin_user, data={"is_active": False}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        response = self.client.get(
+            "/logs/", HTTP_AUTHORIZATION=f"Bearer {tokens['access']}"
+        )
+        self.assertEqual(response.status_code, 401)
+
+        # Test: A refreshed token carries the current claims
+        self.admin_user.is_active = True
+        self.admin_user.save()
+        response = self.client.post("/token/refresh/", {"refresh": tokens["refresh"]})
+        access_token = AccessToken(response.json()["access"])
+        self.assertTrue(access_token["is_active"])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/logs/", HTTP_AUTHORIZATION=f"Bearer {access_token}"
+            )
+        self.assertEqual(response.status_code, 200)
@@ -4,7 +4,7 @@ from drf_spectacular.utils import extend_schema
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from main.authentication import ClaimsJWTAuthentication
 from main.permissions import IsActive, IsInAdminGroupOrStaff
 from .serializers import HealthCheckSerializer, LogSerializer
 
@@ -43,7 +43,7 @@ class HealthCheck(APIView):
 class LogsView(APIView):
     """Read logs"""
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsInAdminGroupOrStaff]
     serializer_class = LogSerializer
 
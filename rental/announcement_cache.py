@@ -0,0 +1,94 @@
+"""
+Stale-while-revalidate cache of the public announcements list.
+
+The rendered announcements (all of them and the active ones) are kept in a
+single cache entry that stays fresh until the next start_at/end_at boundary,
+when the active list may change, or until an announcement is written (which
+bumps the "announcements" resource version). A stale entry is still served
+while a single background thread refreshes it, so the landing page only
+waits on the database when the cache is empty.
+"""
+
+import logging
+import threading
+from django.core.cache import cache
+from django.utils import timezone
+from utils.threads import closes_connections
+from utils.versions import get_resource_version
+from .models import Announcement
+from .serializers import AnnouncementSerializer
+
+transaction_logger = logging.getLogger("transactions")
+
+CACHE_KEY = "announcements_public"
+REFRESH_LOCK_KEY = "announcements_public_refresh"
+# Longest time an entry is fresh when there is no boundary ahead
+MAX_FRESH_TIME = timezone.timedelta(hours=1)
+# Seconds a stale entry is kept to be served while it is refreshed
+STALE_TTL = 60 * 60 * 24
+# Seconds a refresh may take before another one can start
+REFRESH_LOCK_TIMEOUT = 30
+
+
+def get_fresh_until(announcements, now):
+    """Next start_at or end_at boundary, when the active list may change"""
+    boundaries = [
+        moment
+        for announcement in announcements
+        for moment in (announcement.start_at, announcement.end_at)
+        if moment > now
+    ]
+    return min(boundaries + [now + MAX_FRESH_TIME])
+
+
+def refresh() -> dict:
+    """Render the announcements from the database and store the entry"""
+    version = get_resource_version("announcements")
+    now = timezone.now()
+    announcements = list(Announcement.objects.all().order_by("start_at"))
+    entry = {
+        "all": AnnouncementSerializer(announcements, many=True).data,
+        "active": AnnouncementSerializer(
+            [a for a in announcements if a.end_at >= now], many=True
+        ).data,
+        "fresh_until": get_fresh_until(announcements, now),
+        "version": version,
+    }
+    cache.set(CACHE_KEY, entry, STALE_TTL)
+    return entry
+
+
+@closes_connections
+def _refresh_in_thread():
+    try:
+        refresh()
+    except Exception as e:  # pylint: disable=broad-except
+        transaction_logger.error("Error refreshing the announcements cache: %s", e)
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+
+
+def schedule_refresh() -> bool:
+    """Refresh the entry in a background thread, unless a refresh is running"""
+    if not cache.add(REFRESH_LOCK_KEY, True, REFRESH_LOCK_TIMEOUT):
+        return False
+    threading.Thread(
+        target=_refresh_in_thread, name="announcements-refresh", daemon=True
+    ).start()
+    return True
+
+
+def get_public_announcements(only_active=False) -> list:
+    """
+    Rendered announcements ordered by start_at, only the ones that have not
+    ended if only_active. Stale data is returned while it is refreshed
+    """
+    entry = cache.get(CACHE_KEY)
+    if entry is None:
+        entry = refresh()
+    elif (
+        entry["version"] != get_resource_version("announcements")
+        or timezone.now() >= entry["fresh_until"]
+    ):
+        schedule_refresh()
+    return entry["active" if only_active else "all"]
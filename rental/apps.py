@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RentalConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rental"
+
+    def ready(self):
+        # Register the signals keeping the StudentStatus projection updated
+        from . import signals  # pylint: disable=import-outside-toplevel,unused-import
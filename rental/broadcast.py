@@ -0,0 +1,253 @@
+"""
+Outbox for the websocket update messages.
+
+Messages are only queued once the surrounding transaction commits, so rolled
+back changes are never announced. Queued messages are merged per group:
+identical (message, info) pairs are sent once and every "Plays updated" of a
+burst becomes a single message listing all the touched game ids. The burst is
+sent after WEBSOCKET_COALESCE_WINDOW seconds from a background event loop, so
+the request path never waits on the channel layer.
+
+Besides the "updates" group, which receives everything, messages are sent to
+the topic groups clients subscribe to through rental/routing.py: "games",
+"game.<id>", "announcements" and "students".
+
+Clients connected with ?v=2 also receive the public state of the updated
+games in the message ("games", plus the deleted ids at "removed"). It is
+rendered once per burst when the messages are sent, not once per client.
+
+Every message is stamped with a sequence number of its group ("seq") and kept
+in a ring buffer in the cache, so reconnecting clients can ask for the
+messages they missed instead of refetching everything.
+"""
+
+import asyncio
+import logging
+import threading
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from utils.threads import closes_connections
+from utils.versions import bump_resource_version
+from .connections import metrics
+from .models import Game
+from .serializers import GameUnauthenticatedSerializer
+
+transaction_logger = logging.getLogger("transactions")
+
+PLAYS_UPDATED = "Plays updated"
+GAMES_UPDATED = "Games updated"
+
+# Messages kept per group for the reconnecting clients
+REPLAY_BUFFER_SIZE = 256
+# Seconds a message is kept for the reconnecting clients
+REPLAY_TTL = 60 * 60
+
+# Topic groups clients can subscribe to, besides the "game.<id>" groups
+TOPICS = {
+    "games": [PLAYS_UPDATED, GAMES_UPDATED],
+    "announcements": ["Announcements updated"],
+    "students": ["Students updated"],
+}
+
+
+def get_game_group(game_id) -> str:
+    """Group of the clients following a single game"""
+    return f"game.{game_id}"
+
+
+def get_message_groups(message, info=None, room_group_name="updates") -> list:
+    """
+    Groups interested in a message as (group, info) pairs, the game groups
+    only get their own game id as info
+    """
+    groups = [(room_group_name, info)]
+    groups += [(topic, info) for topic, messages in TOPICS.items() if message in messages]
+    if message in (PLAYS_UPDATED, GAMES_UPDATED):
+        games = info if isinstance(info, (list, tuple, set)) else [info]
+        groups += [(get_game_group(game), game) for game in games if game is not None]
+    return groups
+
+
+def get_sequence_key(room_group_name) -> str:
+    return f"websocket_seq_{room_group_name}"
+
+
+def get_event_key(room_group_name, seq) -> str:
+    return f"websocket_event_{room_group_name}_{seq % REPLAY_BUFFER_SIZE}"
+
+
+def record_event(room_group_name, data) -> int:
+    """Stamp a group message with its sequence number and keep it for replays"""
+    key = get_sequence_key(room_group_name)
+    cache.add(key, 0, timeout=None)
+    try:
+        seq = cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add and incr
+        cache.add(key, 0, timeout=None)
+        seq = cache.incr(key)
+    data["seq"] = seq
+    cache.set(get_event_key(room_group_name, seq), data, REPLAY_TTL)
+    return seq
+
+
+async def get_missed_events(room_group_name, last_seq) -> tuple[int, list | None]:
+    """
+    Current sequence of a group and the messages sent after last_seq, the
+    messages are None when some of them are no longer kept and the client
+    has to resync
+    """
+    current = await cache.aget(get_sequence_key(room_group_name), 0)
+    if last_seq > current or current - last_seq > REPLAY_BUFFER_SIZE:
+        # The counter was reset or the buffer rolled over
+        return current, None
+    sequence = range(last_seq + 1, current + 1)
+    keys = [get_event_key(room_group_name, seq) for seq in sequence]
+    events = await cache.aget_many(keys)
+    missed = [events.get(key) for key in keys]
+    if any(event is None or event["seq"] != seq for event, seq in zip(missed, sequence)):
+        return current, None
+    return current, missed
+
+
+def render_games(game_ids) -> dict:
+    """
+    Public state of the games by id, sent to the clients of the protocol v2
+    so they don't need to refetch them. Deleted games are left out.
+    """
+    games = Game.objects.select_related("image").filter(pk__in=game_ids)
+    return {
+        game["id"]: dict(game)
+        for game in GameUnauthenticatedSerializer(games, many=True).data
+    }
+
+
+class BroadcastOutbox:
+    """Buffer merging the update messages of each group until they are sent"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._scheduled = False
+        self._loop = None
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop of the background thread sending the messages"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=self._loop.run_forever, name="broadcast-outbox", daemon=True
+            ).start()
+        return self._loop
+
+    def add(self, message, sender, info=None, room_group_name="updates"):
+        """Queue a message, it is merged with the pending ones of its group"""
+        with self._lock:
+            messages = self._pending.setdefault(room_group_name, {})
+            # Re-adding a message moves it to the end, keeping the last sender
+            pending = messages.pop(message, {"games": {}})
+            pending["sender"] = sender
+            messages[message] = pending
+            for game in info if isinstance(info, (list, tuple, set)) else [info]:
+                if game is not None:
+                    pending["games"][game] = None
+
+            if self._scheduled:
+                return
+            self._scheduled = True
+
+        window = settings.WEBSOCKET_COALESCE_WINDOW
+        if window > 0:
+            loop = self._get_loop()
+            loop.call_soon_threadsafe(
+                loop.call_later, window, loop.create_task, self._flush_async()
+            )
+        else:
+            self.flush()
+
+    def drain(self) -> list[tuple[str, dict]]:
+        """Take the pending messages as (group, data) pairs ready to be sent"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+
+        # The state of the touched games is rendered once for every group
+        game_ids = {
+            game
+            for messages in pending.values()
+            for message in messages.values()
+            for game in message["games"]
+        }
+        states = None
+        if game_ids:
+            try:
+                states = render_games(game_ids)
+            except Exception as e:  # pylint: disable=broad-except
+                transaction_logger.error("Error rendering the updated games: %s", e)
+
+        result = []
+        for room_group_name, messages in pending.items():
+            for message, pending_message in messages.items():
+                games = list(pending_message["games"])
+                data = {
+                    "type": "update_message",
+                    "message": message,
+                    "sender": pending_message["sender"],
+                }
+                if message == PLAYS_UPDATED:
+                    data["type"] = "plays_updated"
+                    # A single game keeps the original message format
+                    data["info"] = games[0] if len(games) == 1 else games or None
+                if games and states is not None:
+                    data["games"] = [states[game] for game in games if game in states]
+                    data["removed"] = [game for game in games if game not in states]
+                try:
+                    record_event(room_group_name, data)
+                except Exception as e:  # pylint: disable=broad-except
+                    transaction_logger.error("Error recording websocket message: %s", e)
+                result.append((room_group_name, data))
+        return result
+
+    @closes_connections
+    def _drain_in_thread(self) -> list[tuple[str, dict]]:
+        return self.drain()
+
+    async def _flush_async(self):
+        channel_layer = get_channel_layer()
+        for room_group_name, data in await sync_to_async(self._drain_in_thread)():
+            try:
+                await channel_layer.group_send(room_group_name, data)
+            except Exception as e:  # pylint: disable=broad-except
+                metrics["dropped"] += 1
+                transaction_logger.error("Error sending message to websocket: %s", e)
+
+    def flush(self):
+        """Send the pending messages from the calling thread"""
+        channel_layer = get_channel_layer()
+        for room_group_name, data in self.drain():
+            try:
+                async_to_sync(channel_layer.group_send)(room_group_name, data)
+            except Exception as e:  # pylint: disable=broad-except
+                metrics["dropped"] += 1
+                transaction_logger.error("Error sending message to websocket: %s", e)
+
+
+outbox = BroadcastOutbox()
+
+
+def send_update_message(message, sender, info=None, room_group_name="updates"):
+    """Queue a message to the websocket, it is sent once the transaction commits"""
+    groups = get_message_groups(message, info, room_group_name)
+    # The cached responses of the updated resources are no longer valid
+    for topic, messages in TOPICS.items():
+        if message in messages:
+            bump_resource_version(topic)
+
+    def add_to_outbox():
+        for group, group_info in groups:
+            outbox.add(message, sender, info=group_info, room_group_name=group)
+
+    transaction.on_commit(add_to_outbox)
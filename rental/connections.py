@@ -0,0 +1,92 @@
+"""
+Liveness of the websocket connections.
+
+Dead peers are detected by daphne with protocol pings (--ping-interval and
+--ping-timeout, see compose.yaml), which every websocket client answers on
+its own. A client that stops reading doesn't answer the pings queued behind
+its messages either, so it's closed by daphne too, as the application can't
+see the write buffer of the connection.
+
+Clients connecting with ?ping=1 also get application pings ({'type': 'ping'},
+answered with {'type': 'pong'}) every WEBSOCKET_PING_INTERVAL seconds, so
+they can detect a stalled connection from their side, and are closed when
+they sent nothing for WEBSOCKET_IDLE_TIMEOUT seconds.
+
+The counters of the server process are kept in `metrics`.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+from django.conf import settings
+
+# Close code of the connections evicted for not answering the pings
+CLOSE_IDLE = 4000
+
+# connected: open sockets, sent: messages sent, dropped: broadcasts the
+# channel layer failed to deliver, evicted_idle: connections closed by the server
+metrics = Counter()
+
+
+def get_metrics() -> dict:
+    """Websocket counters of this server process"""
+    return {
+        name: metrics[name] for name in ("connected", "sent", "dropped", "evicted_idle")
+    }
+
+
+class ManagedConnectionMixin:
+    """
+    Metrics and opt-in application pings for AsyncJsonWebsocketConsumer.
+    Consumers call start_connection() once accepted and stop_connection() on
+    disconnect
+    """
+
+    keepalive_task = None
+    started = False
+
+    async def start_connection(self):
+        self.last_seen = time.monotonic()
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        if query.get("ping") == ["1"]:
+            self.keepalive_task = asyncio.create_task(self.keepalive())
+        self.started = True
+        metrics["connected"] += 1
+
+    async def stop_connection(self):
+        if not self.started:
+            return
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+        self.started = False
+        metrics["connected"] -= 1
+
+    async def send_json(self, content, close=False):
+        await super().send_json(content, close)
+        metrics["sent"] += 1
+
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(settings.WEBSOCKET_PING_INTERVAL)
+            if time.monotonic() - self.last_seen > settings.WEBSOCKET_IDLE_TIMEOUT:
+                metrics["evicted_idle"] += 1
+                # disconnect() runs once the server confirms the close
+                await self.close(CLOSE_IDLE)
+                return
+            await self.send_json({"type": "ping"})
+
+    async def on_pong(self):
+        """Called when the client answers a ping"""
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        """Any message keeps the connection alive, pongs aren't passed on"""
+        self.last_seen = time.monotonic()
+        if text_data:
+            content = await self.decode_json(text_data)
+            if isinstance(content, dict) and content.get("type") == "pong":
+                await self.on_pong()
+                return
+            await self.receive_json(content, **kwargs)
+            return
+        await super().receive(text_data, bytes_data, **kwargs)
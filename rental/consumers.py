@@ -1,28 +1,116 @@
-import json
+import time
+from urllib.parse import parse_qs
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from . import presence
+from .connections import ManagedConnectionMixin
+from .broadcast import TOPICS, get_game_group, get_message_groups, get_missed_events
 
 
-class OnlineUsersConsumer(WebsocketConsumer):
+class OnlineUsersConsumer(ManagedConnectionMixin, AsyncJsonWebsocketConsumer):
     """ 
     Websocket consumer for getting the online users at the index page.
-    """
 
-    def connect(self):
-        return super().connect()
+    Authenticated users are registered as online while connected (see
+    rental/presence.py). Clients send {'type': 'heartbeat'} every
+    HEARTBEAT_INTERVAL seconds, or connect with ?ping=1 and answer the server
+    pings (see rental/connections.py), otherwise they are considered offline
+    after PRESENCE_TTL seconds.
 
+    Every client gets the online users when connecting, {'online': [...]},
+    and then the batched changes:
+    {
+        'joined': [{'id': 1, 'email': 'A01606010@tec.mx'}],
+        'left': [2]
+    }
+    """
 
-class UpdatesConsumer(WebsocketConsumer):
+    user_id = None
+
+    async def connect(self):
+        await self.channel_layer.group_add(presence.PRESENCE_GROUP, self.channel_name)
+        await self.accept(self.scope.get('auth_subprotocol'))
+        await self.start_connection()
+
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated and user.is_active:
+            self.user_id = user.pk
+            # Users built from the token claims load their email once
+            self.email = await database_sync_to_async(getattr)(user, 'email')
+            self.last_heartbeat = time.monotonic()
+            if await presence.join(self.user_id, self.email):
+                await presence.batcher.add(joined={self.user_id: self.email})
+
+        await self.send_json({'online': await presence.get_online_users()})
+
+    async def disconnect(self, code):
+        await self.stop_connection()
+        await self.channel_layer.group_discard(presence.PRESENCE_GROUP, self.channel_name)
+        if self.user_id is not None and await presence.leave(self.user_id):
+            await presence.batcher.add(left=[self.user_id])
+
+    async def receive_json(self, content, **kwargs):
+        """ Receive the heartbeats of the client, other messages are ignored. """
+        if isinstance(content, dict) and content.get('type') == 'heartbeat':
+            await self.heartbeat()
+
+    async def on_pong(self):
+        await self.heartbeat()
+
+    async def heartbeat(self):
+        """ Keep the user online. """
+        if self.user_id is None:
+            return
+        # The entries are refreshed at most once per half interval
+        now = time.monotonic()
+        if now - self.last_heartbeat < presence.HEARTBEAT_INTERVAL / 2:
+            return
+        self.last_heartbeat = now
+
+        joined = {}
+        if await presence.heartbeat(self.user_id, self.email):
+            joined[self.user_id] = self.email
+        left = await presence.sweep()
+        await presence.batcher.add(joined=joined, left=left)
+
+    async def presence_diff(self, event):
+        """ Receive the presence changes from the group and send to WebSocket. """
+        await self.send_json({'joined': event['joined'], 'left': event['left']})
+
+
+class UpdatesConsumer(ManagedConnectionMixin, AsyncJsonWebsocketConsumer):
     """ 
     Websocket consumer for getting the updates of the systems data at the
     index page.
-    TODO: Update to only messages from authenticated users
     TODO: Use this consumer to update the admin CRUD with the data updates
     
     Models interaction is restricted for these consumers.
     Only messages about data updates SHOULD be allowed.
 
+    Anyone can connect and receive the updates, but only the authenticated
+    users (see main.middleware) can send them.
+
+    The consumer runs in the server event loop, so idle sockets don't hold a
+    thread of the sync executor.
+
+    Clients connected to ws/updates/ receive every update, while clients of
+    ws/updates/<topic>/ and ws/updates/games/<id>/ only receive the updates
+    of that topic or game.
+
+    Clients connecting with ?v=2 also receive the public state of the
+    updated games ('games') and the ids of the deleted ones ('removed').
+
+    Clients connecting with ?ping=1 are pinged and evicted when idle, see
+    rental/connections.py.
+
+    Messages sent by the server carry the sequence number of the group
+    ('seq'). A reconnecting client sends {'resume': <last seq>} (or connects
+    with ?since=<last seq>) and gets the messages it missed, or
+    {'resync': true, 'seq': <current seq>} when they are no longer kept and it
+    has to refetch everything. Messages may be received twice around a
+    resume, clients ignore the ones with a seq they have already seen.
+
     Example message:
     {
         'message': 'Plays updated',
@@ -39,37 +127,64 @@ class UpdatesConsumer(WebsocketConsumer):
     # - Students updated
     #   - A student has been deleted, or updated at the admin CRUD
 
-    def connect(self):
-        self.room_group_name = 'updates'
+    room_group_name = 'updates'
+    version = 1
+
+    def get_room_group_name(self):
+        """ Group of the subscribed topic, None if the topic doesn't exist. """
+        kwargs = self.scope.get('url_route', {}).get('kwargs', {})
+        if 'game_id' in kwargs:
+            return get_game_group(kwargs['game_id'])
+        topic = kwargs.get('topic', 'updates')
+        return topic if topic == 'updates' or topic in TOPICS else None
+
+    async def connect(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.version = 2 if query.get('v') == ['2'] else 1
+        self.room_group_name = self.get_room_group_name()
+        if self.room_group_name is None:
+            await self.close()
+            return
 
         # Join room group
-        async_to_sync(self.channel_layer.group_add)(
-            self.room_group_name, self.channel_name
-        )
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+
+        await self.accept(self.scope.get('auth_subprotocol'))
+        await self.start_connection()
 
-        self.accept()
+        if 'since' in query:
+            await self.replay(query['since'][0])
 
-    def disconnect(self, code):
+    async def disconnect(self, code):
+        await self.stop_connection()
+        if self.room_group_name is None:
+            return
         # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(
-            self.room_group_name, self.channel_name
-        )
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    def receive(self, text_data):
+    async def receive_json(self, content, **kwargs):
         """ Receive message from WebSocket with data update. """
         # Must contain 'message' and 'sender'
         # - sender is the username of the user who sent the message
         # - message is the update message describing the update the user made
-         # - info is an optional field that contains the game id of the game that was updated
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        sender = text_data_json['sender']
+        # - info is an optional field that contains the game id of the game that was updated
+        if 'resume' in content:
+            await self.replay(content['resume'])
+            return
+
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.send_json({'detail': 'Authentication credentials were not provided.'})
+            return
+
+        message = content['message']
+        sender = content['sender']
 
         if message == 'Plays updated':
             data = {
                 'type': 'plays_updated',
                 'message': message,
-                'info': text_data_json['info'],
+                'info': content['info'],
                 'sender': sender
             }
         else:
@@ -79,34 +194,51 @@ class UpdatesConsumer(WebsocketConsumer):
                 'sender': sender
             }
 
-        # Send the update message to room group
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name, data
-        )
+        # Send the update message to every interested group
+        for group, info in get_message_groups(message, data.get('info')):
+            if 'info' in data:
+                data = {**data, 'info': info}
+            await self.channel_layer.group_send(group, data)
+
+    async def replay(self, last_seq):
+        """ Send the messages after last_seq or ask the client to resync. """
+        try:
+            current, missed = await get_missed_events(self.room_group_name, int(last_seq))
+        except (TypeError, ValueError):
+            current, missed = 0, None
+        if missed is None:
+            await self.send_json({'resync': True, 'seq': current})
+            return
+        handlers = {
+            'plays_updated': self.plays_updated,
+            'update_message': self.update_message,
+        }
+        for event in missed:
+            await handlers[event['type']](event)
+
+    async def send_update(self, data, event):
+        """ Send the update adding the games state for the v2 clients. """
+        if 'seq' in event:
+            data['seq'] = event['seq']
+        if self.version >= 2 and 'games' in event:
+            data['games'] = event['games']
+            data['removed'] = event['removed']
+        await self.send_json(data)
 
     # Generic update message handler
-    def update_message(self, event):
+    async def update_message(self, event):
         """ Receive message from room group and send to WebSocket. """
-        message = event['message']
-        sender = event['sender']
-
-        # Send message to WebSocket
-        self.send(text_data=json.dumps({
-            'message': message,
-            'sender': sender
-        }))
+        await self.send_update({
+            'message': event['message'],
+            'sender': event['sender']
+        }, event)
 
     # Plays updated message handler
     # info is the game id of the game that was updated
-    def plays_updated(self, event):
+    async def plays_updated(self, event):
         """ Receive message from room group and send to WebSocket. """
-        message = event['message']
-        sender = event['sender']
-        info = event['info']
-
-        # Send message to WebSocket
-        self.send(text_data=json.dumps({
-            'message': message,
-            'info': info,
-            'sender': sender
-        }))
+        await self.send_update({
+            'message': event['message'],
+            'info': event['info'],
+            'sender': event['sender']
+        }, event)
@@ -0,0 +1,177 @@
+"""
+Eligibility engine for starting a play.
+
+All the rules checked before a student can start a play (active play, daily
+limit, weekly limit, active sanctions and the game 50 minutes window) are
+computed by a single annotated query over the game and the StudentStatus
+projection, and the outcome is returned as a structured reason code instead
+of a chain of COUNT queries.
+"""
+
+from enum import Enum
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+from utils.queries import SubqueryCount
+from .models import Game, Play, Student, StudentStatus
+
+# Maximum number of plays a student can have per day and per week
+DAILY_PLAYS_LIMIT = 1
+WEEKLY_PLAYS_LIMIT = 3
+# Minutes a game stays open for new plays since its first active play
+GAME_WINDOW_MINUTES = 50
+# StudentStatus fields read by the engine
+STATUS_FIELDS = [
+    "active_play_id",
+    "plays_today",
+    "day",
+    "weekly_plays",
+    "week_start",
+    "active_sanctions",
+    "sanctions_expire_at",
+]
+
+
+class Reason(str, Enum):
+    """Reason codes returned by the eligibility engine"""
+
+    OK = "ok"
+    GAME_DOES_NOT_EXIST = "game_does_not_exist"
+    ALREADY_PLAYING = "already_playing"
+    PLAYED_TODAY = "played_today"
+    WEEKLY_LIMIT = "weekly_limit"
+    HAS_SANCTIONS = "has_sanctions"
+    GAME_EXPIRED = "game_expired"
+
+
+DETAILS = {
+    Reason.OK: "",
+    Reason.GAME_DOES_NOT_EXIST: "Game does not exist",
+    Reason.ALREADY_PLAYING: "Student is already playing",
+    Reason.PLAYED_TODAY: "Student has already played today",
+    Reason.WEEKLY_LIMIT: f"Student has already played {WEEKLY_PLAYS_LIMIT} times this week",
+    Reason.HAS_SANCTIONS: "Student has sanctions",
+    Reason.GAME_EXPIRED: "Game time has expired",
+}
+
+
+class Eligibility:
+    """
+    Result of an eligibility check
+
+    reason: Reason code, Reason.OK when the student can start the play
+    game: The requested game, None if it does not exist
+    student_exists: Whether the student is already registered
+    game_active_plays: Number of active plays of the game before the new play
+    """
+
+    def __init__(self, reason, game=None, student_exists=False, game_active_plays=0):
+        self.reason = reason
+        self.game = game
+        self.student_exists = student_exists
+        self.game_active_plays = game_active_plays
+
+    @property
+    def allowed(self) -> bool:
+        return self.reason is Reason.OK
+
+    @property
+    def detail(self) -> str:
+        return DETAILS[self.reason]
+
+    def __repr__(self) -> str:
+        return f"<Eligibility {self.reason.value}>"
+
+
+def _student_annotations(student_id) -> dict:
+    """
+    Annotations reading the student status projection, independent from the
+    outer query
+    """
+    status = StudentStatus.objects.filter(student_id=student_id)
+    annotations = {"student_exists": Exists(Student.objects.filter(pk=student_id))}
+    for field in STATUS_FIELDS:
+        annotations[f"status_{field}"] = Subquery(status.values(field)[:1])
+    return annotations
+
+
+def _student_status(student_id, row) -> StudentStatus:
+    """Build the student status from the annotated values"""
+    if row["status_day"] is None:
+        # Students without a status row have no history
+        return StudentStatus(student_id=student_id)
+    return StudentStatus(
+        student_id=student_id,
+        **{field: row[f"status_{field}"] for field in STATUS_FIELDS},
+    )
+
+
+def _student_reason(status: StudentStatus) -> Reason:
+    """Evaluate the student rules in the same order they are reported"""
+    if status.is_playing():
+        return Reason.ALREADY_PLAYING
+    if status.get_played_today() >= DAILY_PLAYS_LIMIT:
+        return Reason.PLAYED_TODAY
+    if status.get_weekly_plays() >= WEEKLY_PLAYS_LIMIT:
+        return Reason.WEEKLY_LIMIT
+    if status.get_sanctions_number() > 0:
+        return Reason.HAS_SANCTIONS
+    return Reason.OK
+
+
+def check_play_eligibility(student_id, game_id) -> Eligibility:
+    """
+    Check if a student can start a play at a game.\n
+    The game row and every rule are fetched by one query, only when the game
+    does not exist a second query is needed to keep the reported reason order.
+    """
+    now = timezone.now()
+    annotations = _student_annotations(student_id)
+
+    game = None
+    try:
+        game = (
+            Game.objects.filter(pk=game_id)
+            .annotate(
+                **annotations,
+                game_active_plays=SubqueryCount(
+                    Play.objects.filter(game=OuterRef("pk"), ended=False).values("pk")
+                ),
+            )
+            .first()
+        )
+    except (TypeError, ValueError):
+        # Invalid game ids are reported as non existent games
+        pass
+
+    if game is None:
+        row = (
+            Student.objects.filter(pk=student_id)
+            .annotate(**annotations)
+            .values(*annotations)
+            .first()
+        )
+        reason = (
+            _student_reason(_student_status(student_id, row))
+            if row is not None
+            else Reason.OK
+        )
+        if reason is Reason.OK:
+            reason = Reason.GAME_DOES_NOT_EXIST
+        return Eligibility(reason, student_exists=row is not None)
+
+    row = {key: getattr(game, key) for key in annotations}
+    reason = _student_reason(_student_status(student_id, row))
+    if (
+        reason is Reason.OK
+        and game.game_active_plays > 0
+        and game.start_time is not None
+        and game.start_time + timezone.timedelta(minutes=GAME_WINDOW_MINUTES) < now
+    ):
+        reason = Reason.GAME_EXPIRED
+
+    return Eligibility(
+        reason,
+        game=game,
+        student_exists=game.student_exists,
+        game_active_plays=game.game_active_plays,
+    )
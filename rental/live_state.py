@@ -0,0 +1,127 @@
+"""
+Live state of the active plays of each game, kept in the cache.
+
+Each game has an entry with its active plays ({play id: student id}) and its
+start_time, and each playing student has an entry with the game they are at.
+The entries are refreshed from the database once the transactions writing
+plays or games commit, so hot reads (the public games list, "is this student
+playing") are served from the cache (Redis in production, locmem in DEBUG)
+instead of SQL. The whole state is rebuilt from the database when the
+readiness marker expires, which bounds any drift.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from .models import Game, Play
+
+# Seconds before the whole live state is rebuilt from the database
+LIVE_STATE_TTL = 60 * 60
+READY_KEY = "live_state_ready"
+
+
+def get_game_key(game_id) -> str:
+    return f"live_game_{game_id}"
+
+
+def get_student_key(student_id) -> str:
+    return f"live_student_{student_id}"
+
+
+def _store(game_ids, games=None) -> dict:
+    """
+    Read the state of the games from the database and store it, games
+    missing from the database are removed. Returns the states by game id
+    """
+    plays = Play.objects.filter(ended=False)
+    if games is None:
+        games = Game.objects.filter(pk__in=game_ids)
+        plays = plays.filter(game_id__in=game_ids)
+    states = {
+        pk: {"plays": {}, "start_time": start_time}
+        for pk, start_time in games.values_list("pk", "start_time")
+    }
+    for pk, game_id, student_id in plays.values_list("pk", "game_id", "student_id"):
+        states[game_id]["plays"][pk] = student_id
+
+    if game_ids is None:
+        game_ids = list(states)
+    previous = cache.get_many([get_game_key(game_id) for game_id in game_ids])
+    students = {
+        student_id: game_id
+        for game_id, state in states.items()
+        for student_id in state["plays"].values()
+    }
+    left = {
+        student_id
+        for state in previous.values()
+        for student_id in state["plays"].values()
+        if student_id not in students
+    }
+
+    cache.set_many(
+        {get_game_key(game_id): state for game_id, state in states.items()},
+        timeout=None,
+    )
+    cache.delete_many([get_game_key(g) for g in game_ids if g not in states])
+    cache.delete_many([get_student_key(student_id) for student_id in left])
+    cache.set_many(
+        {get_student_key(s): game_id for s, game_id in students.items()}, timeout=None
+    )
+    return states
+
+
+def rebuild() -> dict:
+    """Rebuild the state of every game from the database"""
+    states = _store(None, Game.objects.all())
+    cache.set(READY_KEY, True, LIVE_STATE_TTL)
+    return states
+
+
+def refresh_games(game_ids) -> dict:
+    """Refresh the state of some games from the database"""
+    return _store([game_id for game_id in game_ids if game_id is not None])
+
+
+def queue_refresh(game_ids) -> None:
+    """Refresh the state of some games once the transaction commits"""
+    game_ids = set(game_ids)
+    transaction.on_commit(lambda: refresh_games(game_ids))
+
+
+def _ensure_ready() -> None:
+    if not cache.get(READY_KEY):
+        rebuild()
+
+
+def get_games_state(game_ids) -> dict:
+    """
+    State of some games by id ({"plays": {play id: student id},
+    "start_time": datetime}), non existent games are left out
+    """
+    _ensure_ready()
+    keys = {get_game_key(game_id): game_id for game_id in game_ids}
+    states = {keys[key]: state for key, state in cache.get_many(keys).items()}
+    missing = [game_id for game_id in game_ids if game_id not in states]
+    if missing:
+        states.update(refresh_games(missing))
+    return states
+
+
+def get_student_game(student_id) -> int | None:
+    """
+    Game id of the active play of the student, None if they aren't playing.
+    Read without querying the database
+    """
+    _ensure_ready()
+    game_id = cache.get(get_student_key(student_id))
+    if game_id is None:
+        return None
+    state = get_games_state([game_id]).get(game_id)
+    if state is None or student_id not in state["plays"].values():
+        return None
+    return game_id
+
+
+def is_student_playing(student_id) -> bool:
+    """Whether the student has an active play, without querying the database"""
+    return get_student_game(student_id) is not None
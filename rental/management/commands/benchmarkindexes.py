@@ -0,0 +1,187 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+from rental.models import Game, Material, OwedMaterial, Play, Sanction, Student
+
+# Columns of the measured lookups, every index starting with one of them
+# (foreign key, composite and partial) is dropped for the run without indexes
+BENCHMARKED_COLUMNS = {
+    Play: ["student_id", "game_id"],
+    Sanction: ["student_id"],
+    OwedMaterial: ["student_id"],
+}
+
+
+class Rollback(Exception):
+    """Raised to discard the synthetic data"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of the active plays, sanctions and owed materials "
+        "lookups with the current indexes and without any index on their columns "
+        "over a synthetic table. "
+        "Everything runs inside a transaction that is rolled back, but the "
+        "tables stay locked meanwhile, run it against a copy of the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--plays", type=int, default=1_000_000, help="Synthetic plays to insert"
+        )
+        parser.add_argument(
+            "--students", type=int, default=20_000, help="Synthetic students to insert"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=200, help="Lookups measured per query"
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Do not ask for confirmation",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["interactive"]:
+            confirm = input(
+                f"This locks the rental tables of {connection.settings_dict['NAME']} "
+                "until it finishes. Type 'yes' to continue: "
+            )
+            if confirm != "yes":
+                raise CommandError("Benchmark cancelled")
+
+        self.repeat = kwargs["repeat"]
+        try:
+            with transaction.atomic():
+                self.stdout.write("Inserting synthetic data...")
+                self.create_data(kwargs["students"], kwargs["plays"])
+
+                with_indexes = self.measure()
+                # The dropped indexes come back with the rollback
+                self.drop_indexes()
+                without_indexes = self.measure()
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"{'query':<28}{'without (ms)':>14}{'with (ms)':>12}")
+        for name, before in without_indexes.items():
+            after = with_indexes[name]
+            self.stdout.write(f"{name:<28}{before:>14.3f}{after:>12.3f}")
+
+    def get_indexes(self):
+        """Names of the indexes serving the lookups, by table"""
+        with connection.cursor() as cursor:
+            for model, columns in BENCHMARKED_COLUMNS.items():
+                table = model._meta.db_table
+                constraints = connection.introspection.get_constraints(cursor, table)
+                for name, constraint in constraints.items():
+                    if (
+                        constraint["index"]
+                        and not constraint["primary_key"]
+                        and not constraint["unique"]
+                        and constraint["columns"]
+                        and constraint["columns"][0] in columns
+                    ):
+                        yield name
+
+    # The SQL is run directly, SQLite doesn't allow the schema editor context
+    # inside a transaction
+    def drop_indexes(self):
+        names = list(self.get_indexes())
+        with connection.cursor() as cursor:
+            for name in names:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+
+    def create_data(self, students_number, plays_number):
+        """Insert the students, games, plays, sanctions and owed materials"""
+        now = timezone.now()
+        self.student_ids = [f"l{n:08d}" for n in range(students_number)]
+        Student.objects.bulk_create(
+            [Student(id=student_id) for student_id in self.student_ids],
+            batch_size=5000,
+        )
+        games = Game.objects.bulk_create(
+            [Game(name=f"Benchmark {n}") for n in range(50)]
+        )
+        self.game_ids = [game.pk for game in games]
+        material = Material.objects.create(name="Benchmark", amount=1000)
+
+        batch = []
+        for n in range(plays_number):
+            # Only the last plays are still active, as in the real table
+            play = Play(
+                student_id=random.choice(self.student_ids),
+                game_id=random.choice(self.game_ids),
+                ended=n < plays_number - 200,
+            )
+            # bulk_create doesn't call save
+            play.set_local_date(now)
+            batch.append(play)
+            if len(batch) == 5000:
+                Play.objects.bulk_create(batch)
+                batch = []
+        Play.objects.bulk_create(batch)
+
+        Sanction.objects.bulk_create(
+            [
+                Sanction(
+                    cause="Benchmark",
+                    student_id=random.choice(self.student_ids),
+                    end_time=now + timezone.timedelta(days=random.randint(-365, 30)),
+                )
+                for _ in range(students_number // 10)
+            ],
+            batch_size=5000,
+        )
+        OwedMaterial.objects.bulk_create(
+            [
+                OwedMaterial(
+                    material=material,
+                    student_id=random.choice(self.student_ids),
+                    amount=1,
+                    # Most materials have already been delivered
+                    delivered=0 if random.random() < 0.05 else 1,
+                )
+                for _ in range(students_number // 2)
+            ],
+            batch_size=5000,
+        )
+
+    def measure(self) -> dict[str, float]:
+        """Median latency of each lookup in milliseconds"""
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE rental_play, rental_sanction, rental_owedmaterial")
+        now = timezone.now()
+        lookups = {
+            "student active play": lambda: Play.objects.filter(
+                student_id=random.choice(self.student_ids), ended=False
+            ).first(),
+            "game active plays": lambda: list(
+                Play.objects.filter(game_id=random.choice(self.game_ids), ended=False)
+            ),
+            "student active sanctions": lambda: Sanction.objects.filter(
+                student_id=random.choice(self.student_ids), end_time__gte=now
+            ).count(),
+            "student owed materials": lambda: list(
+                OwedMaterial.objects.filter(
+                    student_id=random.choice(self.student_ids),
+                    delivered__lt=models.F("amount"),
+                )
+            ),
+        }
+        results = {}
+        for name, lookup in lookups.items():
+            times = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                lookup()
+                times.append(time.perf_counter() - start)
+            results[name] = statistics.median(times) * 1000
+        return results
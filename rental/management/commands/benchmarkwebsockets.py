@@ -0,0 +1,160 @@
+import asyncio
+import json
+import threading
+import time
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from rental.consumers import UpdatesConsumer
+
+
+class LegacyUpdatesConsumer(WebsocketConsumer):
+    """Sync version of UpdatesConsumer, kept only as the benchmark baseline"""
+
+    room_group_name = "updates"
+
+    def connect(self):
+        async_to_sync(self.channel_layer.group_add)(
+            self.room_group_name, self.channel_name
+        )
+        self.accept()
+
+    def disconnect(self, code):
+        async_to_sync(self.channel_layer.group_discard)(
+            self.room_group_name, self.channel_name
+        )
+
+    def receive(self, text_data=None, bytes_data=None):
+        text_data_json = json.loads(text_data)
+        data = {
+            "type": "update_message",
+            "message": text_data_json["message"],
+            "sender": text_data_json["sender"],
+        }
+        if data["message"] == "Plays updated":
+            data["type"] = "plays_updated"
+            data["info"] = text_data_json["info"]
+        async_to_sync(self.channel_layer.group_send)(self.room_group_name, data)
+
+    def update_message(self, event):
+        self.send(
+            text_data=json.dumps({"message": event["message"], "sender": event["sender"]})
+        )
+
+    def plays_updated(self, event):
+        self.send(
+            text_data=json.dumps(
+                {
+                    "message": event["message"],
+                    "info": event["info"],
+                    "sender": event["sender"],
+                }
+            )
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares how many concurrent update sockets one process holds with the "
+        "legacy sync consumer and the async UpdatesConsumer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sockets",
+            type=int,
+            nargs="+",
+            default=[100, 500, 1000],
+            help="Numbers of concurrent sockets to open on each step",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30,
+            help="Seconds a step may take to connect or deliver a broadcast",
+        )
+
+    def handle(self, *args, **kwargs):
+        consumers = [
+            ("sync", LegacyUpdatesConsumer),
+            ("async", UpdatesConsumer),
+        ]
+        for name, consumer in consumers:
+            held = 0
+            for sockets in kwargs["sockets"]:
+                result = async_to_sync(self.run_step)(
+                    consumer.as_asgi(), sockets, kwargs["timeout"]
+                )
+                if result is None:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"{name}: {sockets} sockets did not finish in {kwargs['timeout']}s"
+                        )
+                    )
+                    break
+                held = sockets
+                connect_time, broadcast_time, threads = result
+                self.stdout.write(
+                    f"{name}: {sockets} sockets, connected in {connect_time:.3f}s, "
+                    f"broadcast delivered in {broadcast_time:.3f}s, "
+                    f"peak threads {threads}"
+                )
+            self.stdout.write(self.style.SUCCESS(f"{name}: held {held} sockets"))
+
+    async def run_step(self, application, sockets, timeout):
+        """
+        Open the sockets at once and deliver one broadcast to all of them,
+        returns the connect and broadcast times and the peak thread count
+        """
+        channel_layer = get_channel_layer()
+        communicators = [
+            WebsocketCommunicator(application, "/ws/updates/") for _ in range(sockets)
+        ]
+        peak_threads = threading.active_count()
+
+        async def sample_threads():
+            nonlocal peak_threads
+            while True:
+                peak_threads = max(peak_threads, threading.active_count())
+                await asyncio.sleep(0.01)
+
+        sampler = asyncio.create_task(sample_threads())
+        try:
+            start = time.perf_counter()
+            await asyncio.wait_for(
+                asyncio.gather(*(communicator.connect() for communicator in communicators)),
+                timeout,
+            )
+            connect_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await channel_layer.group_send(
+                "updates",
+                {
+                    "type": "plays_updated",
+                    "message": "Plays updated",
+                    "info": 1,
+                    "sender": "benchmark",
+                },
+            )
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(communicator.receive_json_from(timeout) for communicator in communicators)
+                ),
+                timeout,
+            )
+            broadcast_time = time.perf_counter() - start
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            sampler.cancel()
+            await asyncio.gather(
+                *(communicator.disconnect() for communicator in communicators),
+                return_exceptions=True,
+            )
+            if hasattr(channel_layer, "flush"):
+                await channel_layer.flush()
+
+        return connect_time, broadcast_time, peak_threads
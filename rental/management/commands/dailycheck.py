@@ -1,7 +1,8 @@
 import logging
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from rental.models import OwedMaterial, Sanction
+from utils.counters import reconcile_row_count, tracked_models
+from rental.models import OwedMaterial, Sanction, Student, StudentStatus
 
 transaction_logger = logging.getLogger("transactions")
 
@@ -34,9 +35,17 @@ class Command(BaseCommand):
             )
         if sanctions:
             Sanction.objects.bulk_create(sanctions)
+            # bulk_create skips the signals, refresh the sanctioned students
+            StudentStatus.rebuild(
+                Student.objects.filter(pk__in={s.student_id for s in sanctions})
+            )
             for log in logs:
                 transaction_logger.info(log)
 
+        # Recount the tables with cached row counters
+        for model in tracked_models:
+            reconcile_row_count(model)
+
         ### Ends the Daily operations code ###
         self.stdout.write(
             self.style.SUCCESS(
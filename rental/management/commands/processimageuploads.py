@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rental.uploads import get_pending_uploads, upload_image
+
+
+class Command(BaseCommand):
+    help = "Uploads to storage the images that are pending, failed or lost"
+    requires_migrations_checks = True
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--daemon",
+            action="store_true",
+            help="Keep running and look for pending uploads every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=30,
+            help="Seconds between each look for pending uploads in daemon mode",
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            image_ids = list(get_pending_uploads().values_list("pk", flat=True))
+            uploaded = sum(upload_image(image_id) for image_id in image_ids)
+            if image_ids:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{uploaded} of {len(image_ids)} pending images uploaded "
+                        f"at {timezone.now()}"
+                    )
+                )
+            if not kwargs["daemon"]:
+                break
+            time.sleep(kwargs["interval"])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rental.live_state import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the live state of the active plays of every game from the database"
+    requires_migrations_checks = True
+
+    def handle(self, *args, **kwargs):
+        states = rebuild()
+        plays = sum(len(state["plays"]) for state in states.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Live state of {len(states)} games and {plays} active plays rebuilt "
+                f"at {timezone.now()}"
+            )
+        )
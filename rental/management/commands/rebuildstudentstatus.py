@@ -0,0 +1,23 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rental.models import StudentStatus
+
+transaction_logger = logging.getLogger("transactions")
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the StudentStatus projection of every student from its history"
+    requires_migrations_checks = True
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(
+            self.style.SUCCESS(f"Student status rebuild started at {timezone.now()}")
+        )
+        statuses = StudentStatus.rebuild()
+        transaction_logger.info("Rebuilt the status of %s students", len(statuses))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Status of {len(statuses)} students rebuilt at {timezone.now()}"
+            )
+        )
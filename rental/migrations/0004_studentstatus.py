@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:30
+
+from datetime import datetime, time
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def build_student_statuses(apps, schema_editor):
+    """
+    Fill the status of the existing students from their history, with the
+    models of this migration (the plays don't have their local date yet)
+    """
+    Student = apps.get_model("rental", "Student")
+    StudentStatus = apps.get_model("rental", "StudentStatus")
+    Play = apps.get_model("rental", "Play")
+    Sanction = apps.get_model("rental", "Sanction")
+    OwedMaterial = apps.get_model("rental", "OwedMaterial")
+
+    now = timezone.now()
+    today = timezone.localdate(now)
+    week_start = today - timezone.timedelta(days=today.weekday())
+    day_start = timezone.make_aware(datetime.combine(today, time()))
+    week_start_time = timezone.make_aware(datetime.combine(week_start, time()))
+
+    def count_by_student(queryset):
+        return dict(
+            queryset.values_list("student").annotate(models.Count("pk")).order_by()
+        )
+
+    active_plays = {}
+    for pk, student_id in (
+        Play.objects.filter(ended=False).order_by("-pk").values_list("pk", "student")
+    ):
+        active_plays[student_id] = pk
+    plays_today = count_by_student(Play.objects.filter(time__gte=day_start))
+    weekly_plays = count_by_student(Play.objects.filter(time__gte=week_start_time))
+    sanctions = Sanction.objects.filter(end_time__gte=now)
+    active_sanctions = count_by_student(sanctions)
+    sanctions_expire_at = dict(
+        sanctions.values_list("student").annotate(models.Min("end_time")).order_by()
+    )
+    owed_materials = count_by_student(
+        OwedMaterial.objects.filter(delivered__lt=models.F("amount"))
+    )
+
+    StudentStatus.objects.bulk_create(
+        [
+            StudentStatus(
+                student_id=student_id,
+                active_play_id=active_plays.get(student_id),
+                plays_today=plays_today.get(student_id, 0),
+                day=today,
+                weekly_plays=weekly_plays.get(student_id, 0),
+                week_start=week_start,
+                active_sanctions=active_sanctions.get(student_id, 0),
+                sanctions_expire_at=sanctions_expire_at.get(student_id),
+                owed_materials=owed_materials.get(student_id, 0),
+            )
+            for student_id in Student.objects.values_list("pk", flat=True).iterator()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0003_announcement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentStatus',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='status', serialize=False, to='rental.student')),
+                ('plays_today', models.PositiveIntegerField(default=0)),
+                ('day', models.DateField(blank=True, null=True)),
+                ('weekly_plays', models.PositiveIntegerField(default=0)),
+                ('week_start', models.DateField(blank=True, null=True)),
+                ('active_sanctions', models.PositiveIntegerField(default=0)),
+                ('sanctions_expire_at', models.DateTimeField(blank=True, null=True)),
+                ('owed_materials', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('active_play', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rental.play')),
+            ],
+        ),
+        migrations.RunPython(build_student_statuses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0004_studentstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='upload_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Existing images were uploaded synchronously when they were saved
+        migrations.AddField(
+            model_name='image',
+            name='upload_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('uploaded', 'Uploaded'), ('failed', 'Failed')], default='uploaded', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='upload_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('uploaded', 'Uploaded'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='upload_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0005_image_upload_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['-time', '-id'], name='rental_play_time_id_idx'),
+        ),
+    ]
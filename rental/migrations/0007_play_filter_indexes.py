@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0006_play_time_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['student', 'time'], name='rental_play_student_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['game', 'ended'], name='rental_play_game_ended_idx'),
+        ),
+    ]
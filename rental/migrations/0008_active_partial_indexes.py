@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0007_play_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='owedmaterial',
+            index=models.Index(condition=models.Q(('delivered__lt', models.F('amount'))), fields=['student'], name='rental_owed_open_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sanction',
+            index=models.Index(fields=['student', 'end_time'], name='rental_sanction_active_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:24
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def set_plays_local_date(apps, schema_editor):
+    """Fill the local date and week of the existing plays from their time"""
+    Play = apps.get_model("rental", "Play")
+    plays = []
+    for play in Play.objects.only("pk", "time").iterator(chunk_size=2000):
+        play.local_date = timezone.localdate(play.time)
+        play.week_start = play.local_date - timezone.timedelta(
+            days=play.local_date.weekday()
+        )
+        plays.append(play)
+        if len(plays) == 2000:
+            Play.objects.bulk_update(plays, ["local_date", "week_start"])
+            plays = []
+    Play.objects.bulk_update(plays, ["local_date", "week_start"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0008_active_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='play',
+            name='time',
+            field=models.DateTimeField(default=timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='play',
+            name='local_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='play',
+            name='week_start',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(set_plays_local_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='play',
+            name='local_date',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='play',
+            name='week_start',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['student', 'local_date'], name='rental_play_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['student', 'week_start'], name='rental_play_student_week_idx'),
+        ),
+    ]
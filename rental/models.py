@@ -3,76 +3,104 @@ from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, MinValueValidator
 from django.utils import timezone
 from supabasecon.client import supabase
+from supabasecon.public_urls import invalidate_public_url
+from utils.queries import SubqueryCount
 
 
 class Image(models.Model):
-    """Modelo de imagenes"""
+    """Modelo de imagenes
+
+    The file is saved locally and pushed to Supabase storage in the
+    background by rental.uploads, upload_status tracks its progress.
+    """
+
+    PENDING = "pending"
+    UPLOADING = "uploading"
+    UPLOADED = "uploaded"
+    FAILED = "failed"
+    UPLOAD_STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (UPLOADING, "Uploading"),
+        (UPLOADED, "Uploaded"),
+        (FAILED, "Failed"),
+    ]
 
     image = models.ImageField(upload_to="images/")
+    upload_status = models.CharField(
+        max_length=10, choices=UPLOAD_STATUS_CHOICES, default=PENDING
+    )
+    upload_attempts = models.PositiveIntegerField(default=0)
+    upload_updated_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.image.name
 
-    @transaction.atomic
-    def save(self, *args, **kwargs):
-        try:
-            # First, save the image to a temporary location using Django's default storage
-            super().save(*args, **kwargs)
-
-            ### The pylint suggestion is suppresed because path property is defined at runtime
-            image_path = self.image.path  # pylint: disable=no-member
-
-            # Determine the content type based on the file extension
-            _, ext = (
-                self.image.name.rsplit(".", 1)
-                if "." in self.image.name
-                else (self.image.name, None)
+    def push_to_storage(self):
+        """Upload the local file to Supabase, raises an exception if it fails"""
+        ### The pylint suggestion is suppresed because path property is defined at runtime
+        image_path = self.image.path  # pylint: disable=no-member
+
+        # Determine the content type based on the file extension
+        _, ext = (
+            self.image.name.rsplit(".", 1)
+            if "." in self.image.name
+            else (self.image.name, None)
+        )
+
+        # Upload the file to Supabase, upsert so retries don't fail on
+        # partially completed uploads
+        with open(image_path, "rb") as f:
+            response = supabase.storage.from_("Cyberprepa").upload(
+                file=f,
+                path=self.image.name,
+                file_options={"content-type": f"image/{ext}", "upsert": "true"},
             )
 
-            # Upload the file to Supabase
-            with open(image_path, "rb") as f:
-                response = supabase.storage.from_("Cyberprepa").upload(
-                    file=f,
-                    path=self.image.name,
-                    file_options={"content-type": f"image/{ext}"},
-                )
+        # Check the upload status code
+        if response.status_code != 200:
+            raise Exception(f"Upload failed with status code: {response.status_code}")
+
+        # Forget any public URL resolved for a previous object with this name
+        invalidate_public_url(self.image.name)
 
-            # Check the upload status code
-            if response.status_code != 200:
+    def remove_from_storage(self):
+        """Delete the file from Supabase, raises an exception if it fails"""
+        image_path = self.image.name
+        response = supabase.storage.from_("Cyberprepa").remove([image_path])
+
+        # Check if the response contains a valid status code inside 'metadata'
+        if response and isinstance(response, list):
+            # Assume the first item in the response list contains the metadata
+            metadata = response[0].get("metadata", {})
+            status_code = metadata.get("httpStatusCode")
+
+            if status_code != 200:
                 raise Exception(
-                    f"Upload failed with status code: {response.status_code}"
+                    f"Failed to delete image {image_path} from Supabase. "
+                    f"HTTP Status: {status_code}"
                 )
-
-        except Exception:
-            raise  # Re-raise the exception to propagate the error
+        else:
+            raise Exception(f"Unexpected response format: {response}")
 
     @transaction.atomic
     def delete(self, *args, **kwargs):
-        try:
-            # Extract image path from the image field
-            image_path = self.image.name
-            # Delete image from Supabase storage
-            response = supabase.storage.from_("Cyberprepa").remove([image_path])
-
-            # Check if the response contains a valid status code inside 'metadata'
-            if response and isinstance(response, list):
-                # Assume the first item in the response list contains the metadata
-                metadata = response[0].get("metadata", {})
-                status_code = metadata.get("httpStatusCode")
+        # The row is locked so an upload in flight records its result after
+        # the deletion, and then removes the object itself (see rental.uploads)
+        upload_status = (
+            Image.objects.select_for_update()
+            .filter(pk=self.pk)
+            .values_list("upload_status", flat=True)
+            .first()
+        )
 
-                if status_code != 200:
-                    raise Exception(
-                        f"Failed to delete image {image_path} from Supabase. HTTP Status: {status_code}"  # pylint: disable=line-too-long
-                    )
-            else:
-                raise Exception(f"Unexpected response format: {response}")
+        # Images not uploaded yet don't exist at Supabase storage
+        if upload_status == self.UPLOADED:
+            self.remove_from_storage()
 
-            # Call the parent class's delete method to delete the record from the database
-            super().delete(*args, **kwargs)
+        invalidate_public_url(self.image.name)
 
-        except Exception as e:
-            # Rollback will be triggered automatically due to the atomic block
-            raise e
+        # Call the parent class's delete method to delete the record from the database
+        super().delete(*args, **kwargs)
 
 
 class Student(models.Model):
@@ -95,30 +123,20 @@ class Student(models.Model):
     hash = models.CharField(max_length=1000, null=True, blank=True)
 
     def is_playing(self):
-        return Play.objects.filter(student=self, ended=False).count() > 0
+        from .live_state import is_student_playing  # pylint: disable=import-outside-toplevel
+
+        return is_student_playing(self.pk)
 
     def get_active_play(self):
         return Play.objects.filter(student=self, ended=False).first()
 
     def get_played_today(self):
-        current_time = timezone.localtime(timezone.now())
-        return Play.objects.filter(student=self, time__date=current_time.date()).count()
+        return Play.objects.filter(student=self, local_date=timezone.localdate()).count()
 
     def get_weekly_plays(self):
-        today = timezone.localtime(timezone.now())
         # Start of the week (Monday)
-        start_of_week = today.combine(
-            (today - timezone.timedelta(days=today.weekday())),
-            timezone.localtime().min.time(),
-        )
-        # End of the week (Sunday)
-        end_of_week = today.combine(
-            (start_of_week + timezone.timedelta(days=6)),
-            timezone.localtime().max.time(),
-        )
-        return Play.objects.filter(
-            student=self, time__date__range=[start_of_week, end_of_week]
-        ).count()
+        start_of_week = StudentStatus.get_week_start(timezone.localdate())
+        return Play.objects.filter(student=self, week_start=start_of_week).count()
 
     def get_sanctions_number(self):
         return Sanction.objects.filter(
@@ -161,11 +179,55 @@ class Game(models.Model):
     def get_plays(self):
         return Play.objects.filter(game=self, ended=False)
 
-    def end_all_plays(self):
-        plays = self.get_plays()
-        for play in plays:
-            play.ended = True
-            play.save()
+    @classmethod
+    def with_active_plays(cls) -> models.QuerySet["Game"]:
+        """
+        Get the games with their image and *active plays* prefetched at `active_plays`.
+        The students of the plays have their notices of the last year prefetched
+        at `recent_notices` and their owed materials at `open_owed_materials`
+        """
+        return cls.objects.select_related("image").prefetch_related(
+            models.Prefetch(
+                "play_set",
+                queryset=Play.objects.filter(ended=False)
+                .select_related("student")
+                .prefetch_related(
+                    models.Prefetch(
+                        "student__notice_set",
+                        queryset=Notice.objects.filter(
+                            created_at__gte=timezone.now()
+                            - timezone.timedelta(days=365)
+                        ),
+                        to_attr="recent_notices",
+                    ),
+                    models.Prefetch(
+                        "student__owedmaterial_set",
+                        queryset=OwedMaterial.objects.filter(
+                            delivered__lt=models.F("amount")
+                        ).select_related("material"),
+                        to_attr="open_owed_materials",
+                    ),
+                )
+                .order_by("pk"),
+                to_attr="active_plays",
+            )
+        )
+
+    @classmethod
+    def with_active_plays_count(cls) -> models.QuerySet["Game"]:
+        """
+        Get the games with their image and the number of *active plays* at
+        `active_plays_count`
+        """
+        return cls.objects.select_related("image").annotate(
+            active_plays_count=SubqueryCount(
+                Play.objects.filter(game=models.OuterRef("pk"), ended=False).values("pk")
+            )
+        )
+
+    def end_all_plays(self) -> list[int]:
+        """End every active play of the game, returns the ended play ids"""
+        return Play.end_active_plays(Play.objects.filter(game=self)).get(self.pk, [])
 
     def __str__(self):
         return f"{self.name} - {self.start_time}"
@@ -177,6 +239,8 @@ class Play(models.Model):
     Relacion al juego que se jugo
     Booleano de si terminó su juego y lo regresó
     Fecha y hora en que jugó
+    Fecha local (TIME_ZONE) en que jugó y lunes de su semana, guardados para
+    que los limites diarios y semanales usen indices
     """
 
     student = models.ForeignKey(
@@ -184,7 +248,68 @@ class Play(models.Model):
     )
     game = models.ForeignKey(Game, on_delete=models.PROTECT, null=False, blank=False)
     ended = models.BooleanField(default=False)
-    time = models.DateTimeField(auto_now_add=True)
+    # Set on creation instead of auto_now_add, so it's known before the insert
+    time = models.DateTimeField(default=timezone.now, editable=False)
+    local_date = models.DateField(editable=False)
+    week_start = models.DateField(editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the plays history
+            models.Index(fields=["-time", "-id"], name="rental_play_time_id_idx"),
+            # Filters of the plays list
+            models.Index(fields=["student", "time"], name="rental_play_student_time_idx"),
+            models.Index(fields=["game", "ended"], name="rental_play_game_ended_idx"),
+            # Daily and weekly plays limits
+            models.Index(fields=["student", "local_date"], name="rental_play_student_date_idx"),
+            models.Index(fields=["student", "week_start"], name="rental_play_student_week_idx"),
+        ]
+
+    def set_local_date(self, time) -> None:
+        """Set the local date and week of the play from its time"""
+        self.local_date = timezone.localdate(time)
+        self.week_start = StudentStatus.get_week_start(self.local_date)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "time" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "local_date", "week_start"}
+        self.set_local_date(self.time)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def end_active_plays(cls, plays=None) -> dict[int, list[int]]:
+        """
+        End the *active plays* of the given queryset (all the plays by default)
+        with a single UPDATE. Returns the ended play ids by game id
+        """
+        if plays is None:
+            plays = cls.objects.all()
+        with transaction.atomic():
+            rows = list(
+                plays.filter(ended=False)
+                .select_for_update()
+                .values_list("pk", "game_id", "student_id")
+            )
+            if not rows:
+                return {}
+            cls.objects.filter(pk__in=[pk for pk, _, _ in rows], ended=False).update(
+                ended=True
+            )
+            # update() skips the signals, refresh the students status
+            StudentStatus.rebuild(
+                Student.objects.filter(pk__in={student for _, _, student in rows})
+            )
+
+        ended = {}
+        for pk, game_id, _ in rows:
+            ended.setdefault(game_id, []).append(pk)
+        # Imported here, the live state module is built on top of the models
+        from .live_state import queue_refresh  # pylint: disable=import-outside-toplevel
+
+        # update() skips the signals, refresh the live state of the games
+        queue_refresh(ended)
+        return ended
 
     def __str__(self):
         return f"{self.student} - {self.game.name} - {self.time}"
@@ -243,6 +368,16 @@ class OwedMaterial(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Materials not fully delivered
+            models.Index(
+                fields=["student"],
+                condition=models.Q(delivered__lt=models.F("amount")),
+                name="rental_owed_open_student_idx",
+            ),
+        ]
+
     @classmethod
     def get_possible_sanctions(cls) -> models.QuerySet["OwedMaterial"]:
         """
@@ -283,10 +418,168 @@ class Sanction(models.Model):
     start_time = models.DateTimeField(auto_now_add=True)
     end_time = models.DateTimeField(null=False, blank=False)
 
+    class Meta:
+        indexes = [
+            # Active sanctions of a student, end_time >= now can't be a
+            # partial index condition as now() is not immutable
+            models.Index(
+                fields=["student", "end_time"], name="rental_sanction_active_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.student} - {self.start_time} - {self.end_time}"
 
 
+class StudentStatus(models.Model):
+    """Projection of the current status of a student
+
+    It is refreshed on every Play, Sanction and OwedMaterial write, so reads
+    don't need to aggregate the student history.
+
+    student: Student the status belongs to
+    active_play: Active play of the student, null if not playing
+    plays_today: Number of plays of the student at `day`
+    day: Local date `plays_today` was computed for
+    weekly_plays: Number of plays of the student at the week starting at `week_start`
+    week_start: Local date of the Monday `weekly_plays` was computed for
+    active_sanctions: Number of active sanctions
+    sanctions_expire_at: End time of the next active sanction to expire
+    owed_materials: Number of materials not fully delivered
+    """
+
+    student = models.OneToOneField(
+        Student, on_delete=models.CASCADE, primary_key=True, related_name="status"
+    )
+    active_play = models.ForeignKey(
+        Play, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    plays_today = models.PositiveIntegerField(default=0)
+    day = models.DateField(null=True, blank=True)
+    weekly_plays = models.PositiveIntegerField(default=0)
+    week_start = models.DateField(null=True, blank=True)
+    active_sanctions = models.PositiveIntegerField(default=0)
+    sanctions_expire_at = models.DateTimeField(null=True, blank=True)
+    owed_materials = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    COMPUTED_FIELDS = [
+        "active_play_id",
+        "plays_today",
+        "weekly_plays",
+        "active_sanctions",
+        "sanctions_expire_at",
+        "owed_materials",
+    ]
+
+    @staticmethod
+    def get_week_start(day):
+        """Monday of the week of the given date"""
+        return day - timezone.timedelta(days=day.weekday())
+
+    @classmethod
+    def get_annotations(cls, student, now) -> dict:
+        """Expressions computing each status field from the student history"""
+        today = timezone.localtime(now).date()
+        start_of_week = cls.get_week_start(today)
+        plays = Play.objects.filter(student=student)
+        sanctions = Sanction.objects.filter(student=student, end_time__gte=now)
+        return {
+            "active_play_id": models.Subquery(
+                plays.filter(ended=False).order_by("pk").values("pk")[:1]
+            ),
+            "plays_today": SubqueryCount(plays.filter(local_date=today).values("pk")),
+            "weekly_plays": SubqueryCount(
+                plays.filter(week_start=start_of_week).values("pk")
+            ),
+            "active_sanctions": SubqueryCount(sanctions.values("pk")),
+            "sanctions_expire_at": models.Subquery(
+                sanctions.order_by("end_time").values("end_time")[:1]
+            ),
+            "owed_materials": SubqueryCount(
+                OwedMaterial.objects.filter(
+                    student=student, delivered__lt=models.F("amount")
+                ).values("pk")
+            ),
+        }
+
+    @classmethod
+    def rebuild(cls, students=None) -> list["StudentStatus"]:
+        """
+        Recompute the status of the given **Student** queryset (all the students
+        by default) from their history with one query and one bulk upsert
+        """
+        now = timezone.now()
+        today = timezone.localtime(now).date()
+        if students is None:
+            students = Student.objects.all()
+        rows = students.annotate(
+            **cls.get_annotations(models.OuterRef("pk"), now)
+        ).values("pk", *cls.COMPUTED_FIELDS)
+        statuses = [
+            cls(
+                student_id=row.pop("pk"),
+                day=today,
+                week_start=cls.get_week_start(today),
+                **row,
+            )
+            for row in rows
+        ]
+        cls.objects.bulk_create(
+            statuses,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["student"],
+            update_fields=[
+                "active_play",
+                "plays_today",
+                "day",
+                "weekly_plays",
+                "week_start",
+                "active_sanctions",
+                "sanctions_expire_at",
+                "owed_materials",
+                "updated_at",
+            ],
+        )
+        return statuses
+
+    @classmethod
+    def refresh(cls, student_id) -> "StudentStatus | None":
+        """Recompute the status of a student, None if the student does not exist"""
+        statuses = cls.rebuild(Student.objects.filter(pk=student_id))
+        return statuses[0] if statuses else None
+
+    def is_playing(self) -> bool:
+        return self.active_play_id is not None
+
+    def get_played_today(self) -> int:
+        # Plays of a previous day are not counted, a play of today would have
+        # refreshed the status
+        if self.day != timezone.localdate():
+            return 0
+        return self.plays_today
+
+    def get_weekly_plays(self) -> int:
+        if self.week_start != self.get_week_start(timezone.localdate()):
+            return 0
+        return self.weekly_plays
+
+    def get_sanctions_number(self) -> int:
+        # Sanctions expire without a write, recompute once the next one ends
+        if (
+            self.sanctions_expire_at is not None
+            and self.sanctions_expire_at < timezone.now()
+        ):
+            refreshed = StudentStatus.refresh(self.student_id)
+            for field in self.COMPUTED_FIELDS:
+                setattr(self, field, getattr(refreshed, field))
+        return self.active_sanctions
+
+    def __str__(self):
+        return f"{self.student_id} status"
+
+
 class Announcement(models.Model):
     """Model for announcements
 
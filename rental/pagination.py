@@ -1,6 +1,47 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from utils.queries import estimate_count
 
 class PlayListPagination(PageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 100
+
+
+class PlayCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the plays history, newest first. Pages are fetched
+    by (time, pk) instead of OFFSET, so deep pages cost the same as the first
+    one. The number of plays is added with ?count=true, approximate for the
+    whole history and exact when the plays are filtered.
+    """
+
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-time', '-pk')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get('count') == 'true':
+            # The estimate is of the whole table, filtered plays are counted
+            if queryset.query.has_filters():
+                self.count = queryset.count()
+            else:
+                self.count = estimate_count(queryset.model)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {
+            'type': 'integer',
+            'description': (
+                'Number of plays, approximate when not filtered, only with ?count=true'
+            ),
+        }
+        return response_schema
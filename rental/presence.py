@@ -0,0 +1,200 @@
+"""
+Presence of the operators (authenticated users) connected to the online
+users websocket.
+
+Each online user has a presence entry in the cache (Redis in production,
+locmem in DEBUG) that expires PRESENCE_TTL seconds after its last heartbeat,
+plus a counter of their open connections, so a user with several dashboards
+only leaves when the last one closes. Heartbeats just refresh the expiry of
+those entries, nothing is written to the database. An index of the online
+users is only rewritten when someone joins or leaves, and the users whose
+entry expired (crashed or lost connections) are swept from it by the first
+heartbeat of every HEARTBEAT_INTERVAL.
+
+The join/leave diffs are merged by PresenceBatcher and sent to the clients
+at most once every PRESENCE_BATCH_WINDOW seconds.
+"""
+
+import asyncio
+import logging
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from .connections import metrics
+
+transaction_logger = logging.getLogger("transactions")
+
+PRESENCE_GROUP = "online_users"
+# Seconds between the heartbeats of the clients
+HEARTBEAT_INTERVAL = 30
+# Seconds a user stays online without heartbeats
+PRESENCE_TTL = HEARTBEAT_INTERVAL * 3
+
+INDEX_KEY = "presence_index"
+INDEX_LOCK_KEY = "presence_index_lock"
+SWEEP_KEY = "presence_sweep"
+
+
+def get_presence_key(user_id) -> str:
+    return f"presence_user_{user_id}"
+
+
+def get_connections_key(user_id) -> str:
+    return f"presence_connections_{user_id}"
+
+
+async def _update_index(update) -> None:
+    """Apply an async update to the index of the online users under a lock"""
+    for _ in range(100):
+        if await cache.aadd(INDEX_LOCK_KEY, True, 5):
+            try:
+                index = await cache.aget(INDEX_KEY, {})
+                await update(index)
+                await cache.aset(INDEX_KEY, index, timeout=None)
+            finally:
+                await cache.adelete(INDEX_LOCK_KEY)
+            return
+        await asyncio.sleep(0.01)
+    transaction_logger.error("Error updating the online users index: lock timeout")
+
+
+async def join_index(user_id, email) -> bool:
+    """Add the presence entry of the user, True if they weren't online"""
+    if not await cache.aadd(get_presence_key(user_id), email, PRESENCE_TTL):
+        return False
+
+    async def add(index):
+        index[user_id] = email
+
+    await _update_index(add)
+    return True
+
+
+async def join(user_id, email) -> bool:
+    """Register a connection of the user, True if the user came online"""
+    connections_key = get_connections_key(user_id)
+    await cache.aadd(connections_key, 0, PRESENCE_TTL)
+    try:
+        await cache.aincr(connections_key)
+    except ValueError:
+        # The counter expired between add and incr
+        await cache.aset(connections_key, 1, PRESENCE_TTL)
+
+    if await join_index(user_id, email):
+        return True
+    await cache.atouch(get_presence_key(user_id), PRESENCE_TTL)
+    return False
+
+
+async def leave(user_id) -> bool:
+    """Unregister a connection of the user, True if the user went offline"""
+    try:
+        connections = await cache.adecr(get_connections_key(user_id))
+    except ValueError:
+        connections = 0
+    if connections > 0:
+        return False
+
+    await cache.adelete_many([get_connections_key(user_id), get_presence_key(user_id)])
+
+    async def remove(index):
+        index.pop(user_id, None)
+
+    await _update_index(remove)
+    return True
+
+
+async def heartbeat(user_id, email) -> bool:
+    """Keep the user online, True if their entry had expired and came back"""
+    await cache.atouch(get_connections_key(user_id), PRESENCE_TTL)
+    if await cache.atouch(get_presence_key(user_id), PRESENCE_TTL):
+        return False
+    # The entry expired while connected (e.g. the server was stalled)
+    await cache.aadd(get_connections_key(user_id), 1, PRESENCE_TTL)
+    return await join_index(user_id, email)
+
+
+async def sweep() -> list:
+    """
+    Remove the users whose entry expired from the index, at most once every
+    HEARTBEAT_INTERVAL. Returns their ids
+    """
+    if not await cache.aadd(SWEEP_KEY, True, HEARTBEAT_INTERVAL):
+        return []
+    index = await cache.aget(INDEX_KEY, {})
+    present = await cache.aget_many([get_presence_key(user_id) for user_id in index])
+    expired = [user_id for user_id in index if get_presence_key(user_id) not in present]
+    if not expired:
+        return []
+
+    async def remove(index):
+        # Users may have joined again meanwhile
+        present = await cache.aget_many([get_presence_key(user_id) for user_id in expired])
+        for user_id in expired:
+            if get_presence_key(user_id) not in present:
+                index.pop(user_id, None)
+
+    await _update_index(remove)
+    return expired
+
+
+async def get_online_users() -> list[dict]:
+    """Online users ({"id", "email"}) ordered by email"""
+    index = await cache.aget(INDEX_KEY, {})
+    keys = {get_presence_key(user_id): user_id for user_id in index}
+    present = await cache.aget_many(keys)
+    users = [{"id": keys[key], "email": email} for key, email in present.items()]
+    return sorted(users, key=lambda user: user["email"])
+
+
+class PresenceBatcher:
+    """
+    Merge the join/leave diffs of a server process and send them to the
+    presence group every PRESENCE_BATCH_WINDOW seconds
+    """
+
+    def __init__(self):
+        self._changes = {}
+        self._scheduled = False
+
+    async def add(self, joined=None, left=()):
+        """Queue the joined users ({id: email}) and the ids of the left ones"""
+        # The last change of each user wins
+        for user_id, email in (joined or {}).items():
+            self._changes[user_id] = email
+        for user_id in left:
+            self._changes[user_id] = None
+        if self._scheduled or not self._changes:
+            return
+
+        window = settings.PRESENCE_BATCH_WINDOW
+        if window > 0:
+            self._scheduled = True
+            asyncio.get_running_loop().call_later(
+                window, lambda: asyncio.ensure_future(self.flush())
+            )
+        else:
+            await self.flush()
+
+    async def flush(self):
+        changes, self._changes = self._changes, {}
+        self._scheduled = False
+        if not changes:
+            return
+        data = {
+            "type": "presence_diff",
+            "joined": [
+                {"id": user_id, "email": email}
+                for user_id, email in changes.items()
+                if email is not None
+            ],
+            "left": [user_id for user_id, email in changes.items() if email is None],
+        }
+        try:
+            await get_channel_layer().group_send(PRESENCE_GROUP, data)
+        except Exception as e:  # pylint: disable=broad-except
+            metrics["dropped"] += 1
+            transaction_logger.error("Error sending presence diff to websocket: %s", e)
+
+
+batcher = PresenceBatcher()
@@ -1,6 +1,9 @@
 from django.urls import path
-from .consumers import UpdatesConsumer
+from .consumers import OnlineUsersConsumer, UpdatesConsumer
 
 websocket_urlpatterns = [
+    path("ws/online-users/", OnlineUsersConsumer.as_asgi()),
     path("ws/updates/", UpdatesConsumer.as_asgi()),
+    path("ws/updates/games/<int:game_id>/", UpdatesConsumer.as_asgi()),
+    path("ws/updates/<str:topic>/", UpdatesConsumer.as_asgi()),
 ]
@@ -1,14 +1,28 @@
 from typing import List
 from drf_spectacular.utils import extend_schema_field
 from rest_framework.serializers import (
+    ListSerializer,
     ModelSerializer,
     SerializerMethodField,
     CharField,
     Serializer,
     IntegerField,
+    ListField,
+)
+from supabasecon.public_urls import get_public_url
+from .live_state import get_games_state
+from .models import (
+    Student,
+    StudentStatus,
+    Play,
+    Game,
+    Sanction,
+    Image,
+    Notice,
+    Material,
+    OwedMaterial,
+    Announcement,
 )
-from supabasecon.client import supabase
-from .models import Student, Play, Game, Sanction, Image, Notice, Material, OwedMaterial, Announcement
 
 
 class StudentSerializer(ModelSerializer):
@@ -26,17 +40,24 @@ class StudentSerializer(ModelSerializer):
             "sanctions_number": {"read_only": True},
         }
 
+    def get_status(self, obj: Student) -> StudentStatus:
+        """Status projection of the student, a blank one if it has no history"""
+        try:
+            return obj.status
+        except StudentStatus.DoesNotExist:
+            return StudentStatus(student_id=obj.pk)
+
     @extend_schema_field(int)
     def get_played_today(self, obj):
-        return obj.get_played_today()
+        return self.get_status(obj).get_played_today()
 
     @extend_schema_field(int)
     def get_weekly_plays(self, obj):
-        return obj.get_weekly_plays()
+        return self.get_status(obj).get_weekly_plays()
 
     @extend_schema_field(int)
     def get_sanctions_number(self, obj):
-        return obj.get_sanctions_number()
+        return self.get_status(obj).get_sanctions_number()
 
 
 class NoticeSerializer(ModelSerializer):
@@ -79,11 +100,28 @@ class PlayGameSerializer(PlaySerializer):
 
     @extend_schema_field(NoticeSerializer(many=True))
     def get_notices(self, obj: Play) -> List[dict]:
-        return NoticeGameSerializer(obj.student.get_notices(), many=True).data
+        # Use the notices prefetched by Game.with_active_plays if available
+        notices = getattr(obj.student, "recent_notices", None)
+        if notices is None:
+            notices = obj.student.get_notices()
+        return NoticeGameSerializer(notices, many=True).data
 
     @extend_schema_field(OwedMaterialSerializer(many=True))
     def get_owed_materials(self, obj: Play) -> List[dict]:
-        return OwedMaterialSerializer(obj.student.get_owed_material(), many=True).data
+        # Use the owed materials prefetched by Game.with_active_plays if available
+        owed_materials = getattr(obj.student, "open_owed_materials", None)
+        if owed_materials is None:
+            owed_materials = obj.student.get_owed_material()
+        return OwedMaterialSerializer(owed_materials, many=True).data
+
+
+class LiveGameListSerializer(ListSerializer):
+    """Read the live state of every listed game at once"""
+
+    def to_representation(self, data):
+        games = list(data.all() if hasattr(data, "all") else data)
+        self.child.live_states = get_games_state([game.pk for game in games])
+        return super().to_representation(games)
 
 
 class GameUnauthenticatedSerializer(ModelSerializer):
@@ -93,16 +131,24 @@ class GameUnauthenticatedSerializer(ModelSerializer):
     class Meta:
         model = Game
         fields = "__all__"
+        list_serializer_class = LiveGameListSerializer
 
     @extend_schema_field(int)
     def get_plays(self, obj: Game) -> int:
+        # The active plays are counted from the live state, not the database
+        live_states = getattr(self, "live_states", None)
+        if live_states is None:
+            live_states = get_games_state([obj.pk])
+        state = live_states.get(obj.pk)
+        if state is not None:
+            return len(state["plays"])
         return obj.get_plays().count()
 
     def get_image(self, obj: Game) -> str:
         image = obj.image
         if image is None:
             return None
-        return supabase.storage.from_("Cyberprepa").get_public_url(image.image.name)
+        return get_public_url(image.image.name)
 
 
 class GameSerializer(ModelSerializer):
@@ -136,13 +182,17 @@ class GameSerializerImageUrl(ModelSerializer):
 
     @extend_schema_field(PlayGameSerializer(many=True))
     def get_plays(self, obj: Game) -> List[dict]:
-        return PlayGameSerializer(obj.get_plays(), many=True).data
+        # Use the plays prefetched by Game.with_active_plays if available
+        plays = getattr(obj, "active_plays", None)
+        if plays is None:
+            plays = obj.get_plays()
+        return PlayGameSerializer(plays, many=True).data
 
     def get_image(self, obj: Game) -> str:
         image = obj.image
         if image is None:
             return None
-        return supabase.storage.from_("Cyberprepa").get_public_url(image.image.name)
+        return get_public_url(image.image.name)
 
 
 class SanctionSerializer(ModelSerializer):
@@ -158,6 +208,7 @@ class ImageSerializer(ModelSerializer):
     class Meta:
         model = Image
         fields = "__all__"
+        read_only_fields = ["upload_status", "upload_attempts", "upload_updated_at"]
 
 
 class ImageReadSerializer(ModelSerializer):
@@ -166,9 +217,22 @@ class ImageReadSerializer(ModelSerializer):
     class Meta:
         model = Image
         fields = "__all__"
+        read_only_fields = ["upload_status", "upload_attempts", "upload_updated_at"]
 
     def get_image(self, obj: Image) -> str:
-        return supabase.storage.from_("Cyberprepa").get_public_url(obj.image.name)
+        return get_public_url(obj.image.name)
+
+
+class OnlineUserSerializer(Serializer):
+    id = IntegerField()
+    email = CharField()
+
+
+class WebsocketMetricsSerializer(Serializer):
+    connected = IntegerField()
+    sent = IntegerField()
+    dropped = IntegerField()
+    evicted_idle = IntegerField()
 
 
 class PaginationMetadataSerializer(Serializer):
@@ -183,6 +247,17 @@ class PaginationMetadataSerializer(Serializer):
         pass
 
 
+class EndAllPlaysSerializer(Serializer):
+    ended_plays = ListField(child=IntegerField())
+    games = ListField(child=IntegerField())
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
+
+
 class AnnouncementSerializer(ModelSerializer):
     class Meta:
         model = Announcement
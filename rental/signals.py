@@ -0,0 +1,137 @@
+"""
+Signals keeping the StudentStatus projection up to date on every Play,
+Sanction and OwedMaterial write, queuing the upload of new images, keeping
+the row counters of the big tables, the live state of the games and the
+version of the cached games and announcements responses.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from utils.counters import track_row_count
+from utils.versions import bump_resource_version
+from .live_state import queue_refresh
+from .models import (
+    Announcement,
+    Game,
+    Image,
+    Material,
+    Notice,
+    OwedMaterial,
+    Play,
+    Sanction,
+    Student,
+    StudentStatus,
+)
+from .uploads import enqueue_upload
+
+
+# Fields whose previous value is kept on updates, as the student status and
+# the live state of the previous student and game have to be refreshed too
+PREVIOUS_FIELDS = {
+    Play: ["student_id", "game_id"],
+    Sanction: ["student_id"],
+    OwedMaterial: ["student_id"],
+}
+
+
+def remember_previous_values(sender, instance, **kwargs):
+    """Keep the previous values of an updated row, read with a single query"""
+    if instance.pk is None:
+        return
+    fields = PREVIOUS_FIELDS[sender]
+    previous = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    for field in fields:
+        setattr(instance, f"_previous_{field}", previous.get(field))
+
+
+def refresh_student_status(sender, instance, **kwargs):
+    """Refresh the status of the students whose history changed"""
+    StudentStatus.refresh(instance.student_id)
+    previous_student_id = getattr(instance, "_previous_student_id", None)
+    if previous_student_id not in (None, instance.student_id):
+        StudentStatus.refresh(previous_student_id)
+
+
+for model in (Play, Sanction, OwedMaterial):
+    pre_save.connect(
+        remember_previous_values,
+        sender=model,
+        dispatch_uid=f"previous_values_pre_save_{model.__name__}",
+    )
+    post_save.connect(
+        refresh_student_status,
+        sender=model,
+        dispatch_uid=f"student_status_post_save_{model.__name__}",
+    )
+    post_delete.connect(
+        refresh_student_status,
+        sender=model,
+        dispatch_uid=f"student_status_post_delete_{model.__name__}",
+    )
+
+
+def queue_image_upload(sender, instance, created, **kwargs):
+    """Upload new images to storage once they are committed"""
+    if created:
+        image_id = instance.pk
+        transaction.on_commit(lambda: enqueue_upload(image_id))
+
+
+post_save.connect(
+    queue_image_upload, sender=Image, dispatch_uid="image_upload_post_save"
+)
+
+
+for model in (Play, Student):
+    track_row_count(model)
+
+
+def refresh_play_games(sender, instance, **kwargs):
+    """Refresh the live state of the games of a play once it is committed"""
+    queue_refresh({instance.game_id, getattr(instance, "_previous_game_id", None)})
+
+
+def refresh_game(sender, instance, **kwargs):
+    """Refresh the live state of a game once it is committed"""
+    queue_refresh({instance.pk})
+
+
+post_save.connect(refresh_play_games, sender=Play, dispatch_uid="live_state_post_save_Play")
+post_delete.connect(refresh_play_games, sender=Play, dispatch_uid="live_state_post_delete_Play")
+post_save.connect(refresh_game, sender=Game, dispatch_uid="live_state_post_save_Game")
+post_delete.connect(refresh_game, sender=Game, dispatch_uid="live_state_post_delete_Game")
+
+
+def bump_games_version(sender, instance, **kwargs):
+    """Invalidate the cached games responses, they render this model"""
+    bump_resource_version("games")
+
+
+for model in (Game, Play, Student, Notice, Material, OwedMaterial, Image):
+    post_save.connect(
+        bump_games_version,
+        sender=model,
+        dispatch_uid=f"games_version_post_save_{model.__name__}",
+    )
+    post_delete.connect(
+        bump_games_version,
+        sender=model,
+        dispatch_uid=f"games_version_post_delete_{model.__name__}",
+    )
+
+
+def bump_announcements_version(sender, instance, **kwargs):
+    """Invalidate the cached announcements"""
+    bump_resource_version("announcements")
+
+
+post_save.connect(
+    bump_announcements_version,
+    sender=Announcement,
+    dispatch_uid="announcements_version_post_save_Announcement",
+)
+post_delete.connect(
+    bump_announcements_version,
+    sender=Announcement,
+    dispatch_uid="announcements_version_post_delete_Announcement",
+)
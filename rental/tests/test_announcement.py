@@ -1,5 +1,7 @@
 import json
 from datetime import timedelta
+from unittest.mock import patch
+from django.core.cache import cache
 from django.test import Client, TestCase
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -25,6 +27,7 @@ class AnnouncementTests(TestCase):
         """
 
         self.client = Client()
+        cache.clear()
 
         self.user = get_user_model().objects.create_user(
             email="A01656583@tec.mx",
@@ -88,6 +91,44 @@ class AnnouncementTests(TestCase):
         )
         validate_announcement_read(response, self.visible_announcement, 1)
 
+    def test_announcement_api_read_cache(self):
+        # Test: The first public read renders the announcements, the next ones don't
+        self.client.get("/rental/announcements/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/rental/announcements/?only-active=True")
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(
+            cache.get("announcements_public")["fresh_until"],
+            self.visible_announcement.end_at,
+        )
+
+        # Test: A write serves the stale list while a single refresh is started
+        with self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.create(
+                title="New Announcement",
+                start_at=timezone.now() - timedelta(minutes=1),
+                end_at=timezone.now() + timedelta(minutes=5),
+            )
+        with patch("rental.announcement_cache.threading.Thread") as thread:
+            first = self.client.get("/rental/announcements/?only-active=True")
+            second = self.client.get("/rental/announcements/?only-active=True")
+        thread.assert_called_once()
+        self.assertEqual(len(first.json()), 1)
+        self.assertEqual(len(second.json()), 1)
+
+        # Test: Once refreshed the new announcement is served
+        thread.call_args.kwargs["target"]()
+        response = self.client.get("/rental/announcements/?only-active=True")
+        self.assertEqual(len(response.json()), 2)
+
+        # Test: Past the next boundary the entry is refreshed again
+        with patch(
+            "rental.announcement_cache.timezone.now",
+            return_value=self.visible_announcement.end_at + timedelta(seconds=1),
+        ), patch("rental.announcement_cache.threading.Thread") as thread:
+            self.client.get("/rental/announcements/?only-active=True")
+        thread.assert_called_once()
+
     def test_announcement_api_read_failure(self):
         # Test: Read via inactive admin user
         access_token = AccessToken.for_user(self.inactive_admin_user)
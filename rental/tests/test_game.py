@@ -1,12 +1,19 @@
 import os
 import json
+import hashlib
+import threading
+import time
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework_simplejwt.tokens import AccessToken
 from PIL import Image as PILImage
-from rental.models import Game, Student, Play, Image
+from rental import live_state
+from rental.models import Game, Student, Play, Image, Notice, Material, OwedMaterial
 
 
 class GameTests(TestCase):
@@ -19,6 +26,9 @@ class GameTests(TestCase):
     def setUp(self):
         # Initialize client and sample data
 
+        # The games responses and live state cached by other tests would
+        # hide the sample games
+        cache.clear()
         self.client = Client()
 
         self.user = get_user_model().objects.create_user(
@@ -162,8 +172,10 @@ class GameTests(TestCase):
         # Test: Check if _end_all_plays ends all plays
         game = Game.objects.get(name="Xbox")
         self.assertEqual(game.get_plays().count(), 2)
-        game.end_all_plays()
+        active_plays = sorted(game.get_plays().values_list("pk", flat=True))
+        self.assertEqual(sorted(game.end_all_plays()), active_plays)
         self.assertEqual(game.get_plays().count(), 0)
+        self.assertFalse(Student.objects.get(id="a01656583").status.is_playing())
 
         game = Game.objects.get(name="Futbolito 1")
         self.assertEqual(game.get_plays().count(), 1)
@@ -175,6 +187,39 @@ class GameTests(TestCase):
         game.end_all_plays()
         self.assertEqual(game.get_plays().count(), 0)
 
+    def test_game_live_state(self):
+        # Test: The live state is rebuilt from the database
+        states = live_state.get_games_state([self.xbox_game.pk, self.futbolito_2.pk])
+        self.assertEqual(
+            sorted(states[self.xbox_game.pk]["plays"].values()), ["a01656583", "a01656584"]
+        )
+        self.assertEqual(states[self.xbox_game.pk]["start_time"], self.xbox_game.start_time)
+        self.assertEqual(states[self.futbolito_2.pk]["plays"], {})
+        self.assertTrue(live_state.is_student_playing("a01656583"))
+        self.assertFalse(live_state.is_student_playing("a01656586"))
+
+        # Test: It is refreshed once the play writes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.create(id="a01656586")
+            play = Play.objects.create(student_id="a01656586", game=self.futbolito_2)
+        with self.assertNumQueries(0):
+            self.assertTrue(live_state.is_student_playing("a01656586"))
+            states = live_state.get_games_state([self.futbolito_2.pk])
+        self.assertEqual(states[self.futbolito_2.pk]["plays"], {play.pk: "a01656586"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            play.game = self.futbolito_1
+            play.save()
+        states = live_state.get_games_state([self.futbolito_1.pk, self.futbolito_2.pk])
+        self.assertIn(play.pk, states[self.futbolito_1.pk]["plays"])
+        self.assertEqual(states[self.futbolito_2.pk]["plays"], {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.xbox_game.end_all_plays()
+        states = live_state.get_games_state([self.xbox_game.pk])
+        self.assertEqual(states[self.xbox_game.pk]["plays"], {})
+        self.assertFalse(live_state.is_student_playing("a01656583"))
+
     def test_games_api_read_list_success(self):
         # Test: List all games via an admin user
         access_token = AccessToken.for_user(self.admin_user)
@@ -200,6 +245,112 @@ class GameTests(TestCase):
         self.assertEqual(len(response.data), 3)
         self.assertEqual(response.json()[0]["plays"], 2)
 
+    def test_games_api_read_list_queries(self):
+        # Test: The number of queries to list the games doesn't grow with the data
+        access_token = AccessToken.for_user(self.admin_user)
+
+        def count_queries(**headers):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/rental/games/", **headers)
+            self.assertEqual(response.status_code, 200)
+            return len(queries), response.json()
+
+        authenticated_queries, _ = count_queries(
+            HTTP_AUTHORIZATION=f"Bearer {access_token}"
+        )
+        # Build the live state of the games
+        count_queries()
+
+        # Add games with active plays, notices and owed materials, the live
+        # state is refreshed once they are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            material = Material.objects.create(name="Control", amount=10)
+            for i in range(5):
+                game = Game.objects.create(name=f"Billar {i}", image=self.red_image_2)
+                student = Student.objects.create(id=f"a0000000{i}")
+                play = Play.objects.create(student=student, game=game)
+                Notice.objects.create(cause="Ruido", play=play, student=student)
+                OwedMaterial.objects.create(material=material, student=student)
+
+        queries, response = count_queries(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        self.assertEqual(queries, authenticated_queries)
+        self.assertEqual(len(response), self.games_count + 5)
+        self.assertEqual(len(response[-1]["plays"]), 1)
+        self.assertEqual(len(response[-1]["plays"][0]["notices"]), 1)
+        self.assertEqual(
+            response[-1]["plays"][0]["owed_materials"][0]["material_name"], "Control"
+        )
+
+        # The active plays are counted from the live state
+        queries, response = count_queries()
+        self.assertEqual(queries, 1)
+        self.assertEqual(response[-1]["plays"], 1)
+
+    def test_games_api_read_list_cache(self):
+        # Test: Unchanged games are served from the cache with an ETag
+        response = self.client.get("/rental/games/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/rental/games/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], etag)
+
+        # Test: Unchanged polls are answered with 304
+        with self.assertNumQueries(0):
+            response = self.client.get("/rental/games/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Test: The authenticated serializer has its own cached response
+        access_token = AccessToken.for_user(self.admin_user)
+        response = self.client.get(
+            "/rental/games/", HTTP_AUTHORIZATION=f"Bearer {access_token}"
+        )
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIsInstance(response.json()[0]["plays"], list)
+
+        # Test: A committed change invalidates the responses
+        with self.captureOnCommitCallbacks(execute=True):
+            Play.objects.create(student_id="a01656583", game=self.futbolito_2)
+        response = self.client.get("/rental/games/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        plays = {game["id"]: game["plays"] for game in response.json()}
+        self.assertEqual(plays[self.futbolito_2.pk], 1)
+
+        # Test: The detail has its own ETag
+        response = self.client.get(f"/rental/games/{self.futbolito_2.pk}/")
+        self.assertEqual(response.json()["plays"], 1)
+        response = self.client.get(
+            f"/rental/games/{self.futbolito_2.pk}/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_games_api_read_list_singleflight(self):
+        # Test: A request waits for the identical one already in flight
+        key = f"singleflight_anonymous_{hashlib.md5(b'/rental/games/').hexdigest()}"
+        cache.set(f"{key}_lock", "leader", 10)
+        shared = [{"id": 1, "name": "Shared", "plays": 0}]
+
+        def finish_leader():
+            time.sleep(0.05)
+            cache.set(f"{key}_result_leader", shared, 5)
+            cache.delete(f"{key}_lock")
+
+        leader = threading.Thread(target=finish_leader)
+        leader.start()
+        with self.assertNumQueries(0):
+            response = self.client.get("/rental/games/")
+        leader.join()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), shared)
+
+        # Test: Without a request in flight the response is computed
+        cache.clear()
+        response = self.client.get("/rental/games/")
+        self.assertEqual(len(response.json()), self.games_count)
+        self.assertIsNone(cache.get(f"{key}_lock"))
+
     def test_games_api_read_list_fail(self):
         # Test: List all games via an inactive admin user
         access_token = AccessToken.for_user(self.inactive_admin_user)
@@ -582,6 +733,43 @@ class GameTests(TestCase):
         game = Game.objects.get(pk=self.xbox_game.pk)
         self.assertEqual(game.get_plays().count(), 0)
 
+    def test_games_api_end_every_game_plays_success(self):
+        # Test: End the plays of every game with a single UPDATE
+        access_token = AccessToken.for_user(self.user)
+        active_plays = sorted(
+            Play.objects.filter(ended=False).values_list("pk", flat=True)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/rental/games/end-all-plays/",
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+        self.assertEqual(response.status_code, 200)
+        response = response.json()
+        self.assertEqual(sorted(response["ended_plays"]), active_plays)
+        self.assertEqual(
+            sorted(response["games"]), [self.xbox_game.pk, self.futbolito_1.pk]
+        )
+        self.assertFalse(Play.objects.filter(ended=False).exists())
+        updates = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "rental_play"')
+        ]
+        self.assertEqual(len(updates), 1)
+
+        # Test: Nothing is ended when there are no active plays
+        response = self.client.post(
+            "/rental/games/end-all-plays/",
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"ended_plays": [], "games": []})
+
+        # Test: End the plays of every game via an unauthenticated user
+        response = self.client.post("/rental/games/end-all-plays/")
+        self.assertEqual(response.status_code, 401)
+
     def test_games_api_end_all_plays_fail(self):
         # Test: End all plays of a game via an unauthenticated user
         response = self.client.post(
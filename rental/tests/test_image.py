@@ -1,12 +1,16 @@
 import os
 import io
+from unittest.mock import Mock, patch
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from PIL import Image as PILImage
 from rest_framework_simplejwt.tokens import AccessToken
+from supabasecon.client import supabase
+from supabasecon.public_urls import get_public_url
 from rental.models import Image
+from rental.uploads import upload_image
 
 
 class ImageTests(TestCase):
@@ -203,3 +207,82 @@ class ImageTests(TestCase):
             HTTP_AUTHORIZATION=f"Bearer {access_token}",
         )
         self.assertEqual(response.status_code, 401)
+
+    def test_image_public_url_cache(self):
+        # Test: The public URL is resolved by the storage client only once per image
+        storage = supabase.storage.from_.return_value
+        name = self.image.image.name
+        get_public_url(name)
+        storage.get_public_url.reset_mock()
+        for _ in range(3):
+            self.assertEqual(
+                get_public_url(name),
+                storage.get_public_url.return_value,
+            )
+        storage.get_public_url.assert_not_called()
+
+        # Test: Deleting the image invalidates its public URL
+        self.image.delete()
+        get_public_url(name)
+        storage.get_public_url.assert_called_once_with(name)
+
+    def test_image_upload_outbox(self):
+        # Test: Saving an image doesn't upload it, the upload is queued on commit
+        storage = supabase.storage.from_.return_value
+        storage.upload.reset_mock()
+        with patch("rental.signals.enqueue_upload") as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                image = self.createImage()
+        storage.upload.assert_not_called()
+        enqueue.assert_called_once_with(image.pk)
+        self.assertEqual(image.upload_status, Image.PENDING)
+
+        # Test: The worker uploads the image and it can't be uploaded twice
+        self.assertTrue(upload_image(image.pk))
+        storage.upload.assert_called_once()
+        image.refresh_from_db()
+        self.assertEqual(image.upload_status, Image.UPLOADED)
+        self.assertEqual(image.upload_attempts, 1)
+        self.assertFalse(upload_image(image.pk))
+
+    @patch("rental.uploads.time.sleep")
+    def test_image_upload_outbox_retries(self, sleep):
+        # Test: Failed uploads are retried and then marked as failed
+        storage = supabase.storage.from_.return_value
+        with patch.object(storage, "upload", return_value=Mock(status_code=500)):
+            self.assertFalse(upload_image(self.image.pk))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.upload_status, Image.FAILED)
+        self.assertEqual(self.image.upload_attempts, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+        # Test: A later run retries the failed image
+        self.assertTrue(upload_image(self.image.pk))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.upload_status, Image.UPLOADED)
+        self.assertEqual(self.image.upload_attempts, 4)
+
+    def test_image_deleted_while_uploading(self):
+        # Test: An image deleted during its upload is removed from storage by the worker
+        storage = supabase.storage.from_.return_value
+        storage.remove.reset_mock()
+        removed = [{"metadata": {"httpStatusCode": 200}}]
+        name = self.image.image.name
+
+        def upload(*args, **kwargs):
+            Image.objects.get(pk=self.image.pk).delete()
+            return Mock(status_code=200)
+
+        with patch.object(storage, "upload", side_effect=upload), patch.object(
+            storage, "remove", return_value=removed
+        ) as remove:
+            self.assertFalse(upload_image(self.image.pk))
+        remove.assert_called_once_with([name])
+        self.assertFalse(Image.objects.filter(pk=self.image.pk).exists())
+
+        # Test: Uploaded images are removed from storage when deleted
+        image = self.createImage()
+        self.assertTrue(upload_image(image.pk))
+        with patch.object(storage, "remove", return_value=removed) as remove:
+            Image.objects.get(pk=image.pk).delete()
+        remove.assert_called_once_with([image.image.name])
@@ -1,10 +1,15 @@
 import json
 from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+from django.db import connection
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.utils import timezone
 from rest_framework_simplejwt.tokens import AccessToken
-from ..models import Game, Student, Play, Sanction
+from ..eligibility import Reason, check_play_eligibility
+from ..models import Game, Student, Play, Sanction, StudentStatus
 
 
 class PlayTests(TestCase):
@@ -21,7 +26,7 @@ class PlayTests(TestCase):
         RULES:
         - CASE 1: The student is already playing
         - CASE 2: The student has already played today
-        - CASE 3: The student has already played 3 times this week      ------------------------- MISSING
+        - CASE 3: The student has already played 3 times this week
         - CASE 4: The student has sanctions
         - CASE 5: The game has expired (50 minutes or more)
         LOGIC:
@@ -348,6 +353,39 @@ class PlayTests(TestCase):
         self.assertTrue(play_7.ended)
         self.assertIsNotNone(play_7.time)
 
+    def test_play_local_date(self):
+        # Test: The local date and week are stored on insert
+        play = Play.objects.create(student_id="a01656589", game=self.billar_2)
+        play.refresh_from_db()
+        today = timezone.localdate()
+        self.assertEqual(play.local_date, today)
+        self.assertEqual(play.week_start, today - timedelta(days=today.weekday()))
+
+        # Test: They follow the time when it changes
+        play.time = timezone.now() - timedelta(days=8)
+        play.save()
+        play.refresh_from_db()
+        self.assertEqual(play.local_date, timezone.localdate(play.time))
+        self.assertEqual(play.week_start.weekday(), 0)
+        self.assertLess(play.week_start, today - timedelta(days=today.weekday()))
+        self.assertEqual(
+            play.student.get_played_today(),
+            Play.objects.filter(student="a01656589", local_date=today).count(),
+        )
+
+        # Test: A play created at another day is stored with its day, and the
+        # status of the student refreshed after the insert already counts it so
+        played_today = StudentStatus.objects.get(student="a01656589").plays_today
+        play = Play.objects.create(
+            student_id="a01656589",
+            game=self.billar_2,
+            time=timezone.now() - timedelta(days=1),
+        )
+        self.assertEqual(play.local_date, timezone.localdate(play.time))
+        self.assertEqual(
+            StudentStatus.objects.get(student="a01656589").plays_today, played_today
+        )
+
     def test_plays_api_read_list_success(self):
         # Test: List all plays via an admin user
         access_token = AccessToken.for_user(self.admin_user)
@@ -377,6 +415,145 @@ class PlayTests(TestCase):
         )
         self.assertEqual(response.status_code, 401)
 
+    def test_plays_api_read_history(self):
+        # Test: Walk the plays history through the cursor pages
+        access_token = AccessToken.for_user(self.user)
+        url = "/rental/plays/history/?page_size=3&count=true"
+        pks = []
+        while url is not None:
+            response = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {access_token}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], self.plays_count)
+            self.assertLessEqual(len(response.data["results"]), 3)
+            pks += [play["id"] for play in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(
+            pks, list(Play.objects.order_by("-time", "-pk").values_list("pk", flat=True))
+        )
+
+        # Test: The count is only added when requested
+        response = self.client.get(
+            "/rental/plays/history/", HTTP_AUTHORIZATION=f"Bearer {access_token}"
+        )
+        self.assertNotIn("count", response.data)
+
+        # Test: The count of the filtered history is of the filtered plays
+        response = self.client.get(
+            f"/rental/plays/history/?game={self.billar_2.pk}&ended=false&count=true",
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEqual(
+            response.data["count"],
+            Play.objects.filter(game=self.billar_2, ended=False).count(),
+        )
+        self.assertEqual(response.data["count"], len(response.data["results"]))
+
+        # Test: List the plays history via an unauthenticated user
+        response = self.client.get("/rental/plays/history/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_plays_api_read_list_filters(self):
+        access_token = AccessToken.for_user(self.user)
+
+        def get_plays(query):
+            response = self.client.get(
+                f"/rental/plays/?{query}", HTTP_AUTHORIZATION=f"Bearer {access_token}"
+            )
+            self.assertEqual(response.status_code, 200)
+            return sorted(play["id"] for play in response.data["results"])
+
+        def pks(queryset):
+            return sorted(queryset.values_list("pk", flat=True))
+
+        # Test: Filter by student, game and ended
+        self.assertEqual(
+            get_plays("student=A01656583"), pks(Play.objects.filter(student="a01656583"))
+        )
+        self.assertEqual(
+            get_plays(f"game={self.xbox_1.pk}&ended=false"),
+            pks(Play.objects.filter(game=self.xbox_1, ended=False)),
+        )
+        self.assertEqual(get_plays("ended=true"), pks(Play.objects.filter(ended=True)))
+
+        # Test: Filter by time range and local date
+        now = timezone.localtime()
+        self.assertEqual(
+            get_plays(f"from={(now - timedelta(minutes=30)).isoformat().replace('+', '%2B')}"),
+            pks(Play.objects.filter(time__gte=now - timedelta(minutes=30))),
+        )
+        self.assertEqual(
+            get_plays(f"date={now.date().isoformat()}"),
+            sorted(
+                play.pk
+                for play in Play.objects.all()
+                if timezone.localtime(play.time).date() == now.date()
+            ),
+        )
+        self.assertEqual(get_plays("date=2000-01-01"), [])
+
+        # Test: Invalid filters
+        for query in ("game=xbox", "from=yesterday", "date=2000-13-01"):
+            response = self.client.get(
+                f"/rental/plays/?{query}", HTTP_AUTHORIZATION=f"Bearer {access_token}"
+            )
+            self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == "postgresql", "Query plans are checked on PostgreSQL")
+    def test_plays_filters_use_indexes(self):
+        queries = {
+            "rental_play_student_time_idx": Play.objects.filter(
+                student_id="a01656583", time__gte=timezone.now() - timedelta(days=1)
+            ),
+            "rental_play_game_ended_idx": Play.objects.filter(
+                game=self.xbox_1, ended=False
+            ),
+            "rental_play_time_id_idx": Play.objects.filter(
+                time__gte=timezone.now() - timedelta(days=1)
+            ).order_by("-time", "-pk"),
+        }
+        with connection.cursor() as cursor:
+            # The sample tables are tiny, make the planner consider the indexes
+            cursor.execute("SET enable_seqscan = off")
+        for index, queryset in queries.items():
+            with self.subTest(index=index):
+                self.assertIn(index, queryset.explain())
+
+    def test_plays_api_pagination_metadata(self):
+        cache.clear()
+        # Test: The counter is created from the table on the first read
+        with self.assertNumQueries(1):
+            response = self.client.get("/rental/plays/pagination/?page_size=3")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], self.plays_count)
+        self.assertEqual(response.data["num_pages"], -(-self.plays_count // 3))
+
+        # Test: The counter follows the inserts and deletes without counting
+        with self.captureOnCommitCallbacks(execute=True):
+            play = Play.objects.create(student_id="a01656589", game=self.billar_2)
+        with self.assertNumQueries(0):
+            response = self.client.get("/rental/plays/pagination/")
+        self.assertEqual(response.data["count"], self.plays_count + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            play.delete()
+        with self.assertNumQueries(0):
+            response = self.client.get("/rental/plays/pagination/")
+        self.assertEqual(response.data["count"], self.plays_count)
+
+        # Test: The plays can't be filtered without an active user
+        url = f"/rental/plays/pagination/?game={self.billar_2.pk}&page_size=1"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+        # Test: The filtered plays are counted
+        access_token = AccessToken.for_user(self.user)
+        response = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        self.assertEqual(response.status_code, 200)
+        count = Play.objects.filter(game=self.billar_2).count()
+        self.assertLess(count, self.plays_count)
+        self.assertEqual(response.data["count"], count)
+        self.assertEqual(response.data["num_pages"], count)
+
     def test_plays_api_create_success_case_1(self):
         """
         CASE 1: The game does not have any active plays, therefore the game.start_time
@@ -568,9 +745,49 @@ class PlayTests(TestCase):
     def test_plays_api_create_fail_case_3(self):
         """
         CASE 3: The student has already played 3 times this week
+        - The daily limit is raised so the plays can be created today, as the
+          week could have started today
         """
-        # Delete after completing the test
-        pass
+        student = Student.objects.get(id="a01656586")
+        Play.objects.filter(student=student).update(ended=True)
+        for _ in range(2):
+            Play.objects.create(student=student, game=self.billar_2, ended=True)
+
+        access_token = AccessToken.for_user(self.user)
+        with patch("rental.eligibility.DAILY_PLAYS_LIMIT", 5):
+            response = self.client.post(
+                "/rental/plays/",
+                json.dumps(
+                    {
+                        "student": "a01656586",
+                        "game": self.xbox_1.pk,
+                    }
+                ),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["detail"], "Student has already played 3 times this week"
+        )
+        self.assertEqual(response.json()["code"], "weekly_limit")
+
+    def test_play_eligibility_single_query(self):
+        """Every play rule must be checked with a single query"""
+        with self.assertNumQueries(1):
+            eligibility = check_play_eligibility("a01656583", self.xbox_1.pk)
+        self.assertEqual(eligibility.reason, Reason.ALREADY_PLAYING)
+
+        with self.assertNumQueries(1):
+            eligibility = check_play_eligibility("a01606060", self.xbox_2.pk)
+        self.assertTrue(eligibility.allowed)
+        self.assertFalse(eligibility.student_exists)
+        self.assertEqual(eligibility.game, self.xbox_2)
+        self.assertEqual(eligibility.game_active_plays, 1)
+
+        with self.assertNumQueries(1):
+            eligibility = check_play_eligibility("a01606060", self.futbolito_1.pk)
+        self.assertEqual(eligibility.reason, Reason.GAME_EXPIRED)
 
     def test_plays_api_create_fail_case_4(self):
         """
@@ -1,7 +1,13 @@
+from importlib import import_module
+from unittest.mock import patch
+from io import StringIO
+from django.apps import apps
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from rest_framework_simplejwt.tokens import AccessToken
-from ..models import Student, Play, Game, Sanction
+from ..models import Material, OwedMaterial, Student, StudentStatus, Play, Game, Sanction
 from django.utils import timezone
 import json
 
@@ -16,6 +22,8 @@ class StudentTests(TestCase):
     def setUp(self):
         # Initialize client and sample data
 
+        # is_playing() reads the live state, which is rebuilt from these plays
+        cache.clear()
         self.client = Client()
 
         self.user = get_user_model().objects.create_user(
@@ -85,6 +93,44 @@ class StudentTests(TestCase):
         self.assertFalse(self.student_2.is_playing())
         self.assertFalse(self.student_3.is_playing())
 
+        # Test: The live state answers without querying the database
+        with self.assertNumQueries(0):
+            self.assertTrue(self.student_1.is_playing())
+
+    @patch("rental.views.send_update_message")
+    def test_owed_material_return_playing_student(self, send_update_message):
+        # Test: Returning a material of a playing student updates their game
+        material = Material.objects.create(name="Control", amount=5)
+        owed_material = OwedMaterial.objects.create(
+            material=material, student=self.student_1, amount=2
+        )
+        access_token = AccessToken.for_user(self.user)
+        response = self.client.post(
+            f"/rental/owed-materials/{owed_material.pk}/return/",
+            {"amount": 1},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEqual(response.status_code, 200)
+        game = Play.objects.get(student=self.student_1, ended=False).game
+        send_update_message.assert_called_once_with(
+            "Plays updated", self.user.email, info=game.pk
+        )
+
+        # Test: Nothing is sent for a student that isn't playing
+        send_update_message.reset_mock()
+        owed_material = OwedMaterial.objects.create(
+            material=material, student=self.student_2, amount=2
+        )
+        response = self.client.post(
+            f"/rental/owed-materials/{owed_material.pk}/return/",
+            {"amount": 1},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEqual(response.status_code, 200)
+        send_update_message.assert_not_called()
+
     def test_student__get_played_today(self):
         # Test: Check if _get_played_today() works correctly
         self.assertEqual(self.student_1.get_played_today(), 1)
@@ -103,6 +149,85 @@ class StudentTests(TestCase):
         self.assertEqual(self.student_2.get_sanctions_number(), 0)
         self.assertEqual(self.student_3.get_sanctions_number(), 1)
 
+    def test_student_status(self):
+        # Test: Check the status projection follows the student history
+        status = StudentStatus.objects.get(student=self.student_1)
+        self.assertTrue(status.is_playing())
+        self.assertEqual(status.get_played_today(), 1)
+        self.assertEqual(status.get_weekly_plays(), 1)
+        self.assertEqual(status.get_sanctions_number(), 0)
+        self.assertFalse(StudentStatus.objects.filter(student=self.student_2).exists())
+
+        status = StudentStatus.objects.get(student=self.student_3)
+        self.assertFalse(status.is_playing())
+        self.assertEqual(status.get_sanctions_number(), 1)
+
+        # Test: Ending the play and expiring the sanction refresh the status
+        Play.objects.get(student=self.student_1).delete()
+        self.assertFalse(StudentStatus.objects.get(student=self.student_1).is_playing())
+        self.assertEqual(
+            StudentStatus.objects.get(student=self.student_1).get_played_today(), 0
+        )
+        # Simulate the time passing after the sanction ended
+        expired = timezone.now() - timezone.timedelta(minutes=1)
+        Sanction.objects.filter(student=self.student_3).update(end_time=expired)
+        StudentStatus.objects.filter(student=self.student_3).update(
+            sanctions_expire_at=expired
+        )
+        status = StudentStatus.objects.get(student=self.student_3)
+        self.assertEqual(status.get_sanctions_number(), 0)
+
+        # Test: Statuses of a previous day or week are not counted
+        StudentStatus.objects.filter(student=self.student_3).update(
+            day=timezone.localdate() - timezone.timedelta(days=7),
+            week_start=timezone.localdate() - timezone.timedelta(days=7),
+        )
+        status = StudentStatus.objects.get(student=self.student_3)
+        self.assertEqual(status.get_played_today(), 0)
+        self.assertEqual(status.get_weekly_plays(), 0)
+
+    def test_student_status_rebuild(self):
+        # Test: The rebuild command restores the projection from the history
+        StudentStatus.objects.all().delete()
+        call_command("rebuildstudentstatus", stdout=StringIO())
+        self.assertEqual(StudentStatus.objects.count(), 3)
+        self.assertTrue(StudentStatus.objects.get(student=self.student_1).is_playing())
+        self.assertEqual(
+            StudentStatus.objects.get(student=self.student_3).get_sanctions_number(), 1
+        )
+
+    def test_student_status_migration(self):
+        # Test: The migration creating the projection fills it like a rebuild
+        rebuilt = {status.pk: status for status in StudentStatus.rebuild()}
+        StudentStatus.objects.all().delete()
+        migration = import_module("rental.migrations.0004_studentstatus")
+        migration.build_student_statuses(apps, None)
+        self.assertEqual(StudentStatus.objects.count(), len(rebuilt))
+        for status in StudentStatus.objects.all():
+            for field in StudentStatus.COMPUTED_FIELDS + ["day", "week_start"]:
+                self.assertEqual(
+                    getattr(status, field), getattr(rebuilt[status.pk], field), field
+                )
+
+    def test_students_api_read_list_queries(self):
+        # Test: Listing students doesn't aggregate the history of each student
+        access_token = AccessToken.for_user(self.admin_user)
+        url = "/rental/students/"
+        response = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        self.assertEqual(response.status_code, 200)
+        students = {student["id"]: student for student in response.json()}
+        self.assertEqual(students["a01656583"]["played_today"], 1)
+        self.assertEqual(students["a01656584"]["weekly_plays"], 0)
+        self.assertEqual(students["a01656585"]["sanctions_number"], 1)
+
+        # User lookup plus the students query
+        with self.assertNumQueries(2):
+            self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        for i in range(10):
+            Student.objects.create(id=f"a0000000{i}")
+        with self.assertNumQueries(2):
+            self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {access_token}")
+
     def test_student_created(self):
         # Test: Check if students were correctly created
         self.assertEqual(Student.objects.count(), 3)
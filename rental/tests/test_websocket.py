@@ -1,11 +1,26 @@
-from django.test import TestCase, AsyncClient
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
+from django.test import TestCase, AsyncClient, override_settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from channels.testing import WebsocketCommunicator
 from rest_framework_simplejwt.tokens import AccessToken
 from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from main.middleware import JWTAuthMiddleware
 from ..models import Game
-from ..consumers import UpdatesConsumer
+from ..broadcast import (
+    REPLAY_BUFFER_SIZE,
+    BroadcastOutbox,
+    record_event,
+    send_update_message,
+)
+from ..consumers import OnlineUsersConsumer, UpdatesConsumer
+from .. import presence
+from ..connections import CLOSE_IDLE, get_metrics
+from ..routing import websocket_urlpatterns
 import json
+import time
 
 """
 from channels.testing import ChannelsLiveServerTestCase
@@ -42,6 +57,8 @@ class WebSocketTests(ChannelsLiveServerTestCase):
 
 class WebSocketTests(TestCase):
     def setUp(self) -> None:
+        # Start without the online users and game states of the previous tests
+        cache.clear()
         self.client = AsyncClient()
 
         self.user = get_user_model().objects.create_user(
@@ -55,7 +72,11 @@ class WebSocketTests(TestCase):
 
     async def test_consumer(self):
         # Connect and check functionality
-        communicator = WebsocketCommunicator(UpdatesConsumer.as_asgi(), "/ws/updates/")
+        access_token = AccessToken.for_user(self.user)
+        communicator = WebsocketCommunicator(
+            JWTAuthMiddleware(UpdatesConsumer.as_asgi()),
+            f"/ws/updates/?token={access_token}",
+        )
         connected, subprotocol = await communicator.connect()
         self.assertTrue(connected)
 
@@ -85,3 +106,423 @@ class WebSocketTests(TestCase):
 
         # Disconnect websocket
         await communicator.disconnect()
+
+    async def test_consumer_authentication(self):
+        application = JWTAuthMiddleware(UpdatesConsumer.as_asgi())
+        access_token = str(AccessToken.for_user(self.user))
+
+        # Anonymous clients receive the updates but can't send them
+        anonymous = WebsocketCommunicator(application, "/ws/updates/")
+        connected, _ = await anonymous.connect()
+        self.assertTrue(connected)
+        await anonymous.send_json_to({"message": "Games updated", "sender": "diego"})
+        self.assertEqual(
+            await anonymous.receive_json_from(),
+            {"detail": "Authentication credentials were not provided."},
+        )
+        self.assertTrue(await anonymous.receive_nothing())
+
+        # Invalid tokens are anonymous too
+        invalid = WebsocketCommunicator(application, "/ws/updates/?token=invalid")
+        connected, _ = await invalid.connect()
+        self.assertTrue(connected)
+        await invalid.send_json_to({"message": "Games updated", "sender": "diego"})
+        self.assertIn("detail", await invalid.receive_json_from())
+
+        # The token can be sent as a subprotocol, the connection accepts it
+        authenticated = WebsocketCommunicator(
+            application, "/ws/updates/", subprotocols=["Bearer", access_token]
+        )
+        connected, subprotocol = await authenticated.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "Bearer")
+        await authenticated.send_json_to({"message": "Games updated", "sender": "diego"})
+        expected = {"message": "Games updated", "sender": "diego"}
+        self.assertEqual(await authenticated.receive_json_from(), expected)
+        self.assertEqual(await anonymous.receive_json_from(), expected)
+
+        # Reconnections with a verified token don't query the database
+        with patch(
+            "main.middleware.authenticate_token", side_effect=AssertionError
+        ):
+            reconnected = WebsocketCommunicator(
+                application, f"/ws/updates/?token={access_token}"
+            )
+            connected, _ = await reconnected.connect()
+            self.assertTrue(connected)
+            await reconnected.send_json_to({"message": "Games updated", "sender": "diego"})
+            self.assertEqual(await reconnected.receive_json_from(), expected)
+
+        # A forged token ending in a cached signature isn't trusted
+        forged = "e30.e30." + access_token.rsplit(".", 1)[-1]
+        forged = WebsocketCommunicator(application, f"/ws/updates/?token={forged}")
+        connected, _ = await forged.connect()
+        self.assertTrue(connected)
+        await forged.send_json_to({"message": "Games updated", "sender": "diego"})
+        self.assertEqual(
+            await forged.receive_json_from(),
+            {"detail": "Authentication credentials were not provided."},
+        )
+
+        for communicator in (anonymous, invalid, authenticated, reconnected, forged):
+            await communicator.disconnect()
+
+    async def test_online_users(self):
+        application = JWTAuthMiddleware(OnlineUsersConsumer.as_asgi())
+        access_token = AccessToken.for_user(self.user)
+        user = {"id": self.user.pk, "email": self.user.email}
+
+        # Anonymous clients see the online users but aren't tracked
+        anonymous = WebsocketCommunicator(application, "/ws/online-users/")
+        connected, _ = await anonymous.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await anonymous.receive_json_from(), {"online": []})
+
+        # A user opening two dashboards joins once
+        dashboards = []
+        for _ in range(2):
+            dashboard = WebsocketCommunicator(
+                application, f"/ws/online-users/?token={access_token}"
+            )
+            connected, _ = await dashboard.connect()
+            self.assertTrue(connected)
+            self.assertEqual(await dashboard.receive_json_from(), {"online": [user]})
+            dashboards.append(dashboard)
+        self.assertEqual(
+            await anonymous.receive_json_from(), {"joined": [user], "left": []}
+        )
+        self.assertTrue(await anonymous.receive_nothing())
+
+        response = await self.client.get(
+            "/rental/online-users/", headers={"Authorization": f"Bearer {access_token}"}
+        )
+        self.assertEqual(response.json(), [user])
+
+        # Heartbeats don't announce anything while the user stays online
+        await dashboards[0].send_json_to({"type": "heartbeat"})
+        self.assertTrue(await anonymous.receive_nothing())
+
+        # The user leaves when the last dashboard closes
+        await dashboards[0].disconnect()
+        self.assertTrue(await anonymous.receive_nothing())
+        await dashboards[1].disconnect()
+        self.assertEqual(
+            await anonymous.receive_json_from(), {"joined": [], "left": [self.user.pk]}
+        )
+        await anonymous.disconnect()
+
+    async def test_online_users_claims_token(self):
+        application = JWTAuthMiddleware(OnlineUsersConsumer.as_asgi())
+        anonymous = WebsocketCommunicator(application, "/ws/online-users/")
+        await anonymous.connect()
+        self.assertEqual(await anonymous.receive_json_from(), {"online": []})
+
+        # A token with role claims and one without identify the same user
+        response = await self.client.post(
+            "/token/", {"email": self.user.email, "password": "Mypass123!"}
+        )
+        tokens = [response.json()["access"], AccessToken.for_user(self.user)]
+        user = {"id": self.user.pk, "email": self.user.email}
+        dashboards = []
+        for token in tokens:
+            dashboard = WebsocketCommunicator(
+                application, f"/ws/online-users/?token={token}"
+            )
+            await dashboard.connect()
+            self.assertEqual(await dashboard.receive_json_from(), {"online": [user]})
+            dashboards.append(dashboard)
+        self.assertEqual(
+            await anonymous.receive_json_from(), {"joined": [user], "left": []}
+        )
+        self.assertTrue(await anonymous.receive_nothing())
+
+        for dashboard in dashboards:
+            await dashboard.disconnect()
+        self.assertEqual(
+            await anonymous.receive_json_from(), {"joined": [], "left": [self.user.pk]}
+        )
+        await anonymous.disconnect()
+
+    async def test_presence_sweep(self):
+        # Users whose entry expired without leaving are swept from the index
+        self.assertTrue(await presence.join(1, "a@tec.mx"))
+        self.assertTrue(await presence.join(2, "b@tec.mx"))
+        await cache.adelete(presence.get_presence_key(1))
+        self.assertEqual(await presence.sweep(), [1])
+        self.assertEqual(
+            await presence.get_online_users(), [{"id": 2, "email": "b@tec.mx"}]
+        )
+        # Sweeps run at most once per heartbeat interval
+        await cache.adelete(presence.get_presence_key(2))
+        self.assertEqual(await presence.sweep(), [])
+
+        # A heartbeat after the entry expired brings the user back
+        self.assertTrue(await presence.heartbeat(2, "b@tec.mx"))
+        self.assertFalse(await presence.heartbeat(2, "b@tec.mx"))
+
+    @override_settings(WEBSOCKET_PING_INTERVAL=0.05, WEBSOCKET_IDLE_TIMEOUT=0.2)
+    async def test_consumer_keepalive(self):
+        before = get_metrics()
+        communicator = WebsocketCommunicator(
+            UpdatesConsumer.as_asgi(), "/ws/updates/?ping=1"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(get_metrics()["connected"], before["connected"] + 1)
+
+        # Answered pings keep the connection open
+        for _ in range(6):
+            self.assertEqual(await communicator.receive_json_from(), {"type": "ping"})
+            await communicator.send_json_to({"type": "pong"})
+
+        # A client that stops answering is evicted
+        output = await communicator.receive_output()
+        while output["type"] == "websocket.send":
+            output = await communicator.receive_output()
+        self.assertEqual(output, {"type": "websocket.close", "code": CLOSE_IDLE})
+        await communicator.disconnect()
+        metrics = get_metrics()
+        self.assertEqual(metrics["evicted_idle"], before["evicted_idle"] + 1)
+        self.assertEqual(metrics["connected"], before["connected"])
+
+        # Clients that don't ask for pings are left to the protocol pings
+        communicator = WebsocketCommunicator(UpdatesConsumer.as_asgi(), "/ws/updates/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+        await communicator.disconnect()
+        self.assertEqual(get_metrics()["evicted_idle"], before["evicted_idle"] + 1)
+
+    @override_settings(WEBSOCKET_COALESCE_WINDOW=0, PRESENCE_BATCH_WINDOW=0)
+    async def test_consumer_metrics(self):
+        before = get_metrics()
+        communicator = WebsocketCommunicator(UpdatesConsumer.as_asgi(), "/ws/updates/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(get_metrics()["connected"], before["connected"] + 1)
+
+        for game in range(3):
+            event = {
+                "type": "plays_updated",
+                "message": "Plays updated",
+                "info": game,
+                "sender": "diego",
+            }
+            await get_channel_layer().group_send("updates", event)
+            self.assertEqual((await communicator.receive_json_from())["info"], game)
+        await communicator.disconnect()
+        metrics = get_metrics()
+        self.assertEqual(metrics["sent"], before["sent"] + 3)
+        self.assertEqual(metrics["connected"], before["connected"])
+
+        # The broadcasts the channel layer fails to deliver are dropped
+        failing = MagicMock(group_send=AsyncMock(side_effect=RuntimeError))
+        with patch("rental.broadcast.get_channel_layer", return_value=failing), patch(
+            "rental.presence.get_channel_layer", return_value=failing
+        ), patch("rental.broadcast.render_games", return_value={}):
+            await sync_to_async(BroadcastOutbox().add)("Games updated", "diego")
+            await presence.PresenceBatcher().add(joined={1: "a@tec.mx"})
+        metrics = get_metrics()
+        self.assertEqual(metrics["dropped"], before["dropped"] + 2)
+
+        # The metrics are available to the admins
+        access_token = AccessToken.for_user(
+            await sync_to_async(get_user_model().objects.create_superuser)(
+                email="diegoDev@tec.mx", password="MyStrongPass123!!!"
+            )
+        )
+        response = await self.client.get(
+            "/rental/websocket-metrics/",
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        self.assertEqual(response.json(), metrics)
+
+    @override_settings(WEBSOCKET_COALESCE_WINDOW=0.01)
+    def test_broadcast_outbox(self):
+        channel_layer = MagicMock(group_send=AsyncMock())
+        # The games are rendered from the flusher thread, outside the test transaction
+        with patch("rental.broadcast.get_channel_layer", return_value=channel_layer), patch(
+            "rental.broadcast.outbox", BroadcastOutbox()
+        ), patch("rental.broadcast.render_games", return_value={}):
+            # Nothing is queued until the transaction commits
+            with self.captureOnCommitCallbacks(execute=True):
+                send_update_message("Plays updated", "diego", info=1)
+                send_update_message("Plays updated", "diego", info=2)
+                send_update_message("Plays updated", "diego", info=1)
+                send_update_message("Games updated", "diego")
+                send_update_message("Games updated", "diego")
+                channel_layer.group_send.assert_not_called()
+
+            # The burst is merged into one message per kind and group
+            for _ in range(100):
+                if channel_layer.group_send.await_count >= 6:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.05)
+            self.assertEqual(channel_layer.group_send.await_count, 6)
+            channel_layer.group_send.assert_any_await(
+                "updates",
+                {
+                    "type": "plays_updated",
+                    "message": "Plays updated",
+                    "info": [1, 2],
+                    "sender": "diego",
+                    "games": [],
+                    "removed": [1, 2],
+                    "seq": ANY,
+                },
+            )
+            channel_layer.group_send.assert_any_await(
+                "updates",
+                {
+                    "type": "update_message",
+                    "message": "Games updated",
+                    "sender": "diego",
+                    "seq": ANY,
+                },
+            )
+            # Game followers only get their own game
+            channel_layer.group_send.assert_any_await(
+                "game.2",
+                {
+                    "type": "plays_updated",
+                    "message": "Plays updated",
+                    "info": 2,
+                    "sender": "diego",
+                    "games": [],
+                    "removed": [2],
+                    "seq": ANY,
+                },
+            )
+
+    async def test_consumer_topics(self):
+        application = URLRouter(websocket_urlpatterns)
+        everything = WebsocketCommunicator(application, "/ws/updates/")
+        game_1 = WebsocketCommunicator(application, "/ws/updates/games/1/")
+        game_2 = WebsocketCommunicator(application, "/ws/updates/games/2/")
+        announcements = WebsocketCommunicator(application, "/ws/updates/announcements/")
+        everything.scope["user"] = self.user
+        for communicator in (everything, game_1, game_2, announcements):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+        # Unknown topics are rejected
+        unknown = WebsocketCommunicator(application, "/ws/updates/unknown/")
+        connected, _ = await unknown.connect()
+        self.assertFalse(connected)
+
+        # Only the game followers receive its plays updates
+        await everything.send_json_to(
+            {"message": "Plays updated", "sender": "diego", "info": 2}
+        )
+        expected = {"message": "Plays updated", "sender": "diego", "info": 2}
+        self.assertEqual(await everything.receive_json_from(), expected)
+        self.assertEqual(await game_2.receive_json_from(), expected)
+        self.assertTrue(await game_1.receive_nothing())
+        self.assertTrue(await announcements.receive_nothing())
+
+        await everything.send_json_to(
+            {"message": "Announcements updated", "sender": "diego"}
+        )
+        expected = {"message": "Announcements updated", "sender": "diego"}
+        self.assertEqual(await everything.receive_json_from(), expected)
+        self.assertEqual(await announcements.receive_json_from(), expected)
+        self.assertTrue(await game_1.receive_nothing())
+        self.assertTrue(await game_2.receive_nothing())
+
+        for communicator in (everything, game_1, game_2, announcements):
+            await communicator.disconnect()
+
+    @override_settings(WEBSOCKET_COALESCE_WINDOW=0)
+    def test_broadcast_games_state(self):
+        channel_layer = MagicMock(group_send=AsyncMock())
+        with patch("rental.broadcast.get_channel_layer", return_value=channel_layer), patch(
+            "rental.broadcast.outbox", BroadcastOutbox()
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_update_message("Plays updated", "diego", info=[self.xbox_1.pk, 999])
+
+        # The state is rendered once and shared by every group
+        data = dict(channel_layer.group_send.await_args_list[0].args[1])
+        self.assertEqual(data["info"], [self.xbox_1.pk, 999])
+        self.assertEqual(len(data["games"]), 1)
+        self.assertEqual(data["games"][0]["id"], self.xbox_1.pk)
+        self.assertEqual(data["games"][0]["plays"], 0)
+        self.assertEqual(data["removed"], [999])
+        for call in channel_layer.group_send.await_args_list:
+            if call.args[0] == "updates":
+                self.assertIs(call.args[1]["games"][0], data["games"][0])
+
+    async def test_consumer_games_state(self):
+        v1 = WebsocketCommunicator(UpdatesConsumer.as_asgi(), "/ws/updates/")
+        v2 = WebsocketCommunicator(UpdatesConsumer.as_asgi(), "/ws/updates/?v=2")
+        for communicator in (v1, v2):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+        event = {
+            "type": "plays_updated",
+            "message": "Plays updated",
+            "info": 1,
+            "sender": "diego",
+            "games": [{"id": 1, "name": "Xbox 1", "plays": 1}],
+            "removed": [],
+        }
+        await get_channel_layer().group_send("updates", event)
+        self.assertEqual(
+            await v1.receive_json_from(),
+            {"message": "Plays updated", "info": 1, "sender": "diego"},
+        )
+        self.assertEqual(
+            await v2.receive_json_from(),
+            {
+                "message": "Plays updated",
+                "info": 1,
+                "sender": "diego",
+                "games": [{"id": 1, "name": "Xbox 1", "plays": 1}],
+                "removed": [],
+            },
+        )
+
+        for communicator in (v1, v2):
+            await communicator.disconnect()
+
+    async def test_consumer_replay(self):
+        seqs = []
+        for game in (1, 2, 3):
+            event = {
+                "type": "plays_updated",
+                "message": "Plays updated",
+                "info": game,
+                "sender": "diego",
+            }
+            seqs.append(await sync_to_async(record_event)("updates", event))
+        self.assertEqual(seqs, [seqs[0], seqs[0] + 1, seqs[0] + 2])
+
+        # Resume from a message, only the following ones are sent
+        communicator = WebsocketCommunicator(UpdatesConsumer.as_asgi(), "/ws/updates/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({"resume": seqs[0]})
+        for game, seq in ((2, seqs[1]), (3, seqs[2])):
+            self.assertEqual(
+                await communicator.receive_json_from(),
+                {"message": "Plays updated", "info": game, "sender": "diego", "seq": seq},
+            )
+        self.assertTrue(await communicator.receive_nothing())
+
+        # Messages no longer kept require a full resync
+        await communicator.send_json_to({"resume": seqs[2] - REPLAY_BUFFER_SIZE - 1})
+        self.assertEqual(
+            await communicator.receive_json_from(), {"resync": True, "seq": seqs[2]}
+        )
+        await communicator.disconnect()
+
+        # Resume at connection time
+        communicator = WebsocketCommunicator(
+            UpdatesConsumer.as_asgi(), f"/ws/updates/?since={seqs[1]}"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["seq"], seqs[2])
+        await communicator.disconnect()
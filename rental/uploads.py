@@ -0,0 +1,118 @@
+"""
+Outbox for pushing the images to Supabase storage.
+
+Saving an Image only writes the row and the local file, once the transaction
+commits the upload is queued to a thread pool, so neither the request worker
+nor a DB connection is held during the network call. Uploads are retried with
+a backoff and the images left behind (failed, or lost on a restart) are
+picked up by the processimageuploads command. Images deleted while their
+upload is in flight are removed from storage once the upload finishes.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, models
+from django.utils import timezone
+from utils.threads import closes_connections
+from .models import Image
+
+transaction_logger = logging.getLogger("transactions")
+
+# Attempts made each time an image is processed
+ATTEMPTS_PER_RUN = 3
+# Seconds waited after the first failed attempt, doubled on every retry
+RETRY_BACKOFF = 1
+# Images failing this many attempts are not retried anymore
+MAX_ATTEMPTS = 15
+# Uploads claimed longer than this are considered lost and claimed again
+STALE_UPLOAD = timezone.timedelta(minutes=10)
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool running the uploads, created on first use"""
+    global _executor  # pylint: disable=global-statement
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_UPLOAD_WORKERS,
+            thread_name_prefix="image-upload",
+        )
+    return _executor
+
+
+def enqueue_upload(image_id) -> None:
+    """Queue the upload of an image to the thread pool"""
+    get_executor().submit(_run_in_thread, image_id)
+
+
+@closes_connections
+def _run_in_thread(image_id) -> None:
+    try:
+        upload_image(image_id)
+    except Exception as e:  # pylint: disable=broad-except
+        transaction_logger.error("Error uploading image %s: %s", image_id, e)
+
+
+def get_pending_uploads() -> models.QuerySet[Image]:
+    """Images that have to be uploaded, including retries and lost uploads"""
+    return Image.objects.filter(
+        models.Q(upload_status__in=[Image.PENDING, Image.FAILED])
+        | models.Q(
+            upload_status=Image.UPLOADING,
+            upload_updated_at__lt=timezone.now() - STALE_UPLOAD,
+        ),
+        upload_attempts__lt=MAX_ATTEMPTS,
+    )
+
+
+def upload_image(image_id) -> bool:
+    """
+    Push an image to storage retrying with a backoff.\n
+    The image is claimed first so the thread pool and the command don't
+    upload it twice, returns True if it was uploaded by this call.
+    """
+    if not get_pending_uploads().filter(pk=image_id).update(
+        upload_status=Image.UPLOADING, upload_updated_at=timezone.now()
+    ):
+        return False
+
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None:
+        return False
+    # Don't hold a connection during the network calls, it is reopened
+    # lazily to record the result
+    if not connection.in_atomic_block:
+        connection.close()
+
+    uploaded = False
+    attempts = 0
+    while not uploaded and attempts < ATTEMPTS_PER_RUN:
+        if attempts > 0:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempts - 1))
+        attempts += 1
+        try:
+            image.push_to_storage()
+            uploaded = True
+        except Exception as e:  # pylint: disable=broad-except
+            transaction_logger.warning(
+                "Upload attempt %s of image %s failed: %s", attempts, image, e
+            )
+
+    recorded = Image.objects.filter(pk=image_id).update(
+        upload_status=Image.UPLOADED if uploaded else Image.FAILED,
+        upload_attempts=models.F("upload_attempts") + attempts,
+        upload_updated_at=timezone.now(),
+    )
+    if uploaded and not recorded:
+        # The image was deleted during the upload, which left the object to us
+        transaction_logger.info("Image %s deleted while uploading", image)
+        image.remove_from_storage()
+        return False
+    if uploaded:
+        transaction_logger.info("Image %s uploaded to storage", image)
+    else:
+        transaction_logger.error("Image %s could not be uploaded to storage", image)
+    return uploaded
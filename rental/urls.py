@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import (
     PlayListCreateView,
+    PlayHistoryView,
     PlayPaginationMetadataView,
     PlayDetailView,
     StudentListCreateView,
@@ -8,6 +9,7 @@ from .views import (
     GameListCreateView,
     GameDetailView,
     GameEndAllPlaysView,
+    GamesEndAllPlaysView,
     SanctionListCreateView,
     SanctionDetailView,
     ImageListCreateView,
@@ -23,10 +25,13 @@ from .views import (
     OwedMaterialReturnView,
     AnnouncementListCreateView,
     AnnouncementDetailView,
+    OnlineUsersView,
+    WebsocketMetricsView,
 )
 
 urlpatterns = [
     path("plays/", PlayListCreateView.as_view(), name="plays-list-create"),
+    path("plays/history/", PlayHistoryView.as_view(), name="plays-history"),
     path("plays/pagination/", PlayPaginationMetadataView.as_view(), name="plays-pagination"),
     path("plays/<int:pk>/", PlayDetailView.as_view(), name="plays-detail"),
     path("plays/<int:pk>/forgot-id", StudentSetForgotIdView.as_view(), name="plays-forgotten-id"),
@@ -34,6 +39,11 @@ urlpatterns = [
     path("students/<str:pk>/", StudentDetailView.as_view(), name="students-detail"),
     path("students/<str:pk>/returned-id", StudentRemoveForgotIdView.as_view(), name="student-returned-id"),
     path("games/", GameListCreateView.as_view(), name="games-list-create"),
+    path(
+        "games/end-all-plays/",
+        GamesEndAllPlaysView.as_view(),
+        name="games-end-all-plays-every-game",
+    ),
     path("games/<int:pk>/", GameDetailView.as_view(), name="games-detail"),
     path("games/<int:pk>/end-all-plays/", GameEndAllPlaysView.as_view(), name="games-end-all-plays"),
     path("sanctions/", SanctionListCreateView.as_view(), name="sanctions-list-create"),
@@ -49,4 +59,6 @@ urlpatterns = [
     path("owed-materials/<int:pk>/return/", OwedMaterialReturnView.as_view(), name="owed-materials-return"),
     path("announcements/", AnnouncementListCreateView.as_view(), name="announcements-list-create"),
     path("announcements/<int:pk>/", AnnouncementDetailView.as_view(), name="announcements-detail"),
+    path("online-users/", OnlineUsersView.as_view(), name="online-users"),
+    path("websocket-metrics/", WebsocketMetricsView.as_view(), name="websocket-metrics"),
 ]
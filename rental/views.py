@@ -3,20 +3,25 @@ Views for handling the Cyber rental API and the websocket updates.
 """
 
 import logging
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from datetime import date, datetime
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 from django.db.models.deletion import ProtectedError
 from django.db import transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from asgiref.sync import async_to_sync
 from drf_spectacular.utils import extend_schema
 from rest_framework import status
 from rest_framework import generics
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from utils.counters import get_row_count
+from utils.singleflight import SingleflightMixin
 from utils.strings import safe_ascii
+from utils.versions import VersionedCacheMixin
+from main.authentication import ClaimsJWTAuthentication
 from main.permissions import (
     IsActive,
     IsInAdminGroupOrStaff,
@@ -34,7 +39,13 @@ from .models import (
     OwedMaterial,
     Announcement,
 )
-from .pagination import PlayListPagination
+from .announcement_cache import get_public_announcements
+from .broadcast import send_update_message
+from .connections import get_metrics
+from .presence import get_online_users
+from .eligibility import check_play_eligibility
+from .live_state import get_student_game
+from .pagination import PlayCursorPagination, PlayListPagination
 from .serializers import (
     NoticeSerializer,
     StudentSerializer,
@@ -48,39 +59,65 @@ from .serializers import (
     MaterialSerializer,
     OwedMaterialSerializer,
     PaginationMetadataSerializer,
+    EndAllPlaysSerializer,
     AnnouncementSerializer,
+    OnlineUserSerializer,
+    WebsocketMetricsSerializer,
 )
 
 transaction_logger = logging.getLogger("transactions")
 
 
-def send_update_message(message, sender, info=None, room_group_name="updates"):
-    """Send a message to the websocket to inform about the or something else"""
-    try:
-        channel_layer = get_channel_layer()
-        if message == "Plays updated":
-            data = {
-                "type": "plays_updated",
-                "message": message,
-                "info": info,
-                "sender": sender,
-            }
-        else:
-            data = {
-                "type": "update_message",
-                "message": message,
-                "sender": sender,
-            }
-        async_to_sync(channel_layer.group_send)(room_group_name, data)
-    except Exception as e:
-        transaction_logger.error("Error sending message to websocket: %s", e)
+class PlayFilterMixin:
+    """
+    Filter the plays by the query parameters, each one is served by an index
+    - student: Student id
+    - game: Game id
+    - ended: true or false
+    - from, to: ISO datetimes limiting the play time, both inclusive
+    - date: Local date (YYYY-MM-DD) of the play
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if params.get("student"):
+            queryset = queryset.filter(student_id=params["student"].lower())
+        if params.get("game"):
+            if not params["game"].isdigit():
+                raise ParseError("Invalid game id")
+            queryset = queryset.filter(game_id=params["game"])
+        if params.get("ended") in ("true", "false"):
+            queryset = queryset.filter(ended=params["ended"] == "true")
+        for param, lookup in (("from", "time__gte"), ("to", "time__lte")):
+            if params.get(param):
+                try:
+                    value = parse_datetime(params[param])
+                except ValueError:
+                    value = None
+                if value is None:
+                    raise ParseError(f"Invalid {param} datetime")
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+        if params.get("date"):
+            try:
+                day = date.fromisoformat(params["date"])
+            except ValueError:
+                raise ParseError("Invalid date")
+            # Range over the local day, so the time index is used
+            start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+            queryset = queryset.filter(
+                time__gte=start, time__lt=start + timezone.timedelta(days=1)
+            )
+        return queryset
 
 
-class PlayListCreateView(generics.ListCreateAPIView):
+class PlayListCreateView(PlayFilterMixin, generics.ListCreateAPIView):
     """Create and Read Plays"""
 
     queryset = Play.objects.all().order_by("-pk")
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive]
     serializer_class = PlaySerializer
     pagination_class = PlayListPagination
@@ -98,94 +135,77 @@ class PlayListCreateView(generics.ListCreateAPIView):
                 {"detail": "Invalid student id"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        student, created = Student.objects.get_or_create(id=student_id)
-        if created is False:
-            if student.is_playing() is True:
-                return Response(
-                    {"detail": "Student is already playing"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            if student.get_played_today() >= 1:
-                return Response(
-                    {"detail": "Student has already played today"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            if student.get_weekly_plays() >= 3:
-                return Response(
-                    {"detail": "Student has already played 3 times this week"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            if student.get_sanctions_number() > 0:
-                return Response(
-                    {"detail": "Student has sanctions"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
 
-        try:
-            game = Game.objects.get(pk=request.data["game"])
-        except Game.DoesNotExist:
+        # Every play rule is checked with a single query
+        eligibility = check_play_eligibility(student_id, request.data.get("game"))
+        if not eligibility.allowed:
             return Response(
-                {"detail": "Game does not exist"},
+                {"detail": eligibility.detail, "code": eligibility.reason.value},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # If game has no plays, then this is the first play, and we should set
-        # the game start_time to the play time to start counting the 50 minutes
-        if game.get_plays().count() == 0:
-            response = super().create(request, *args, **kwargs)
-            play = Play.objects.get(pk=response.data["id"])
-            game.start_time = play.time
-            game.save()
-            # Send a message to the websocket to inform about the new play
-            send_update_message(
-                "Plays updated",
-                request.user.email,
-                info=game.pk,
-            )
-            transaction_logger.info(
-                "%s initiated play %s for student %s at game %s",
-                request.user.email,
-                play.pk,
-                play.student.id,
-                play.game.name,
-            )
-            return response
-        else:
-            # If game.start_time is 50 or more minutes ago, then the game time
-            # has expired and we should not allow more plays
-            if game.start_time + timezone.timedelta(minutes=50) < timezone.now():
-                return Response(
-                    {"detail": "Game time has expired"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            else:
-                response = super().create(request, *args, **kwargs)
-                play = Play.objects.get(pk=response.data["id"])
+        game = eligibility.game
+        with transaction.atomic():
+            if not eligibility.student_exists:
+                Student.objects.get_or_create(id=student_id)
+            play = Play.objects.create(student_id=student_id, game=game)
+            # If game has no plays, then this is the first play, and we should set
+            # the game start_time to the play time to start counting the 50 minutes
+            if eligibility.game_active_plays == 0:
+                game.start_time = play.time
+                game.save(update_fields=["start_time"])
 
-                # Send a message to the websocket to inform about the new play
-                send_update_message(
-                    "Plays updated",
-                    request.user.email,
-                    info=game.pk,
-                )
+        # Send a message to the websocket to inform about the new play
+        send_update_message(
+            "Plays updated",
+            request.user.email,
+            info=game.pk,
+        )
+        transaction_logger.info(
+            "%s initiated play %s for student %s at game %s",
+            request.user.email,
+            play.pk,
+            student_id,
+            game.name,
+        )
+        serializer = self.get_serializer(play)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-                transaction_logger.info(
-                    "%s initiated play %s for student %s at game %s",
-                    request.user.email,
-                    play.pk,
-                    play.student.id,
-                    play.game.name,
-                )
-                return response
+
+class PlayHistoryView(PlayFilterMixin, generics.ListAPIView):
+    """Read the plays history with cursor pagination"""
+
+    queryset = Play.objects.all()
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsActive]
+    serializer_class = PlaySerializer
+    pagination_class = PlayCursorPagination
 
 
-class PlayPaginationMetadataView(APIView):
-    """View to return pagination metadata for Play objects."""
+class PlayPaginationMetadataView(PlayFilterMixin, generics.GenericAPIView):
+    """
+    View to return pagination metadata for Play objects.
+    Anyone can read the total, active users can also pass the filters of
+    the plays list.
+    """
+
+    queryset = Play.objects.all()
+    authentication_classes = [ClaimsJWTAuthentication]
+    serializer_class = PaginationMetadataSerializer
 
     def get(self, request, *args, **kwargs):
         # Pagination details
         page_size = request.query_params.get("page_size", 100)
-        total_count = Play.objects.count()
+        queryset = self.get_queryset()
+        if queryset.query.has_filters():
+            # The filtered counts tell who played when, like the plays list
+            if not request.user.is_active:
+                self.permission_denied(request)
+            total_count = queryset.count()
+        else:
+            # Cached counter, the plays table is not scanned
+            total_count = get_row_count(Play)
         num_pages = (total_count // int(page_size)) + (
             1 if total_count % int(page_size) > 0 else 0
         )
@@ -206,7 +226,7 @@ class PlayDetailView(generics.RetrieveUpdateDestroyAPIView):
     """Read, Update and Delete Play(id)"""
 
     queryset = Play.objects.all()
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive]
     serializer_class = PlaySerializer
     http_method_names = ["get", "patch", "delete"]
@@ -299,8 +319,8 @@ class PlayDetailView(generics.RetrieveUpdateDestroyAPIView):
 class StudentListCreateView(generics.ListCreateAPIView):
     """Create and Read Students"""
 
-    queryset = Student.objects.all()
-    authentication_classes = [JWTAuthentication]
+    queryset = Student.objects.select_related("status")
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsInAdminGroupOrStaff]
     serializer_class = StudentSerializer
 
@@ -315,8 +335,8 @@ class StudentListCreateView(generics.ListCreateAPIView):
 class StudentDetailView(generics.RetrieveDestroyAPIView):
     """Read, Update and Delete Student(id)"""
 
-    queryset = Student.objects.all()
-    authentication_classes = [JWTAuthentication]
+    queryset = Student.objects.select_related("status")
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsInAdminGroupOrStaff]
     serializer_class = StudentSerializer
 
@@ -336,11 +356,22 @@ class StudentDetailView(generics.RetrieveDestroyAPIView):
             )
 
 
-class GameListCreateView(generics.ListCreateAPIView):
+class GameListCreateView(
+    VersionedCacheMixin, SingleflightMixin, generics.ListCreateAPIView
+):
     """Create and Read Games"""
 
     queryset = Game.objects.all().order_by("pk")
     permission_classes = [AdminWriteAllRead]
+    cache_resource = "games"
+
+    def get_queryset(self):
+        # Read the plays of every game with a fixed number of queries
+        if self.request.method == "GET" and not self.request.user.is_authenticated:
+            return Game.objects.select_related("image").order_by("pk")
+        elif self.request.method == "GET" and self.request.user.is_authenticated:
+            return Game.with_active_plays().order_by("pk")
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.request.method == "GET" and not self.request.user.is_authenticated:
@@ -359,15 +390,24 @@ class GameListCreateView(generics.ListCreateAPIView):
         send_update_message(
             "Games updated",
             request.user.email,
+            info=response.data["id"],
         )
         return response
 
 
-class GameDetailView(generics.RetrieveUpdateDestroyAPIView):
+class GameDetailView(VersionedCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     """Read, Update and Delete Game(id)"""
 
     queryset = Game.objects.all()
     permission_classes = [AdminWriteAllRead]
+    cache_resource = "games"
+
+    def get_queryset(self):
+        if self.request.method == "GET" and not self.request.user.is_authenticated:
+            return Game.objects.select_related("image")
+        elif self.request.method == "GET" and self.request.user.is_authenticated:
+            return Game.with_active_plays()
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.request.method == "GET" and not self.request.user.is_authenticated:
@@ -393,6 +433,7 @@ class GameDetailView(generics.RetrieveUpdateDestroyAPIView):
         send_update_message(
             "Games updated",
             request.user.email,
+            info=instance.pk,
         )
         return response
 
@@ -408,6 +449,7 @@ class GameDetailView(generics.RetrieveUpdateDestroyAPIView):
             send_update_message(
                 "Games updated",
                 request.user.email,
+                info=instance.pk,
             )
             return response
         except ProtectedError:
@@ -420,7 +462,7 @@ class GameDetailView(generics.RetrieveUpdateDestroyAPIView):
 class GameEndAllPlaysView(generics.GenericAPIView):
     """End all plays of a game"""
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive]
     serializer_class = GameSerializer
 
@@ -442,11 +484,45 @@ class GameEndAllPlaysView(generics.GenericAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class GamesEndAllPlaysView(generics.GenericAPIView):
+    """End all plays of every game"""
+
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsActive]
+    serializer_class = EndAllPlaysSerializer
+
+    @extend_schema(
+        request=None,
+        description="Set all plays of every game ended to True",
+        operation_id="rental_games_end_all_plays_every_game_create",
+    )
+    def post(self, request):
+        ended = Play.end_active_plays()
+        serializer = self.get_serializer(
+            {
+                "ended_plays": [pk for plays in ended.values() for pk in plays],
+                "games": list(ended),
+            }
+        )
+        # Log the transaction
+        transaction_logger.info(
+            "%s ended all plays of %s games", request.user.email, len(ended)
+        )
+        # Send a single message to the websocket with every updated game
+        if ended:
+            send_update_message(
+                "Plays updated",
+                request.user.email,
+                info=list(ended),
+            )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class SanctionListCreateView(generics.ListCreateAPIView):
     """Create and Read Sanctions"""
 
     queryset = Sanction.objects.all().order_by("pk")
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive]
     serializer_class = SanctionSerializer
 
@@ -479,7 +555,7 @@ class SanctionDetailView(generics.RetrieveUpdateDestroyAPIView):
     """Read, Update and Delete Sanction(id)"""
 
     queryset = Sanction.objects.all()
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive]
     serializer_class = SanctionSerializer
 
@@ -510,7 +586,7 @@ class ImageListCreateView(generics.ListCreateAPIView):
     """Create and Read Images"""
 
     queryset = Image.objects.all().order_by("pk")
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsInAdminGroupOrStaff]
 
     def get_serializer_class(self):
@@ -531,7 +607,7 @@ class ImageDetailView(generics.RetrieveDestroyAPIView):
     """Read and Delete Image(id)"""
 
     queryset = Image.objects.all()
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsInAdminGroupOrStaff]
 
     def get_serializer_class(self):
@@ -847,12 +923,12 @@ class OwedMaterialReturnView(generics.GenericAPIView):
 
         # Send a message to the websocket to inform about the returned material
         # only if the student is currently playing
-        play = owed_material.student.get_active_play()
-        if play is not None:
+        game_id = get_student_game(owed_material.student_id)
+        if game_id is not None:
             send_update_message(
                 "Plays updated",
                 request.user.email,
-                info=play.game.pk,
+                info=game_id,
             )
 
         # Log the transaction
@@ -866,7 +942,7 @@ class OwedMaterialReturnView(generics.GenericAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class AnnouncementListCreateView(generics.ListCreateAPIView):
+class AnnouncementListCreateView(SingleflightMixin, generics.ListCreateAPIView):
     """Create and Read Announcements"""
 
     permission_classes = [AdminWriteAllRead]
@@ -881,6 +957,13 @@ class AnnouncementListCreateView(generics.ListCreateAPIView):
             queryset = queryset.filter(end_at__gte=timezone.now())
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # The public landing page is served from the announcements cache
+        if not request.user.is_authenticated:
+            only_active = bool(request.query_params.get("only-active"))
+            return Response(get_public_announcements(only_active))
+        return super().list(request, *args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
         # Send a message to the websocket to inform about the new announcement
@@ -937,3 +1020,28 @@ class AnnouncementDetailView(generics.RetrieveUpdateDestroyAPIView):
             request.user.email,
         )
         return response
+
+
+class OnlineUsersView(APIView):
+    """Read the online operators, connected to the online users websocket"""
+
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsActive]
+
+    @extend_schema(responses={200: OnlineUserSerializer(many=True)})
+    def get(self, request, *args, **kwargs):
+        # Read from the presence entries in the cache, not the database
+        users = async_to_sync(get_online_users)()
+        return Response(OnlineUserSerializer(users, many=True).data)
+
+
+class WebsocketMetricsView(APIView):
+    """Read the websocket counters of the server process"""
+
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsActive, IsInAdminGroupOrStaff]
+
+    @extend_schema(responses={200: WebsocketMetricsSerializer})
+    def get(self, request, *args, **kwargs):
+        return Response(WebsocketMetricsSerializer(get_metrics()).data)
+
@@ -0,0 +1,48 @@
+"""
+Resolution of the public URLs of the images stored at the Supabase bucket.
+
+The public URL of an object only depends on its name, so it is derived once
+and kept in-process and in the configured Django cache, list endpoints don't
+need to use the storage client on the read path.
+"""
+
+from django.core.cache import cache
+from .client import supabase
+
+BUCKET = "Cyberprepa"
+CACHE_KEY_PREFIX = "supabase_public_url_"
+CACHE_TIMEOUT = 60 * 60 * 24  # 1 day
+# Maximum number of URLs kept in-process
+MAX_LOCAL_URLS = 1024
+
+_local_urls: dict[str, str] = {}
+
+
+def _cache_key(name: str) -> str:
+    return f"{CACHE_KEY_PREFIX}{name}"
+
+
+def get_public_url(name: str) -> str | None:
+    """Get the public URL of an object of the bucket, None if there is no name"""
+    if not name:
+        return None
+
+    url = _local_urls.get(name)
+    if url is not None:
+        return url
+
+    url = cache.get(_cache_key(name))
+    if url is None:
+        url = supabase.storage.from_(BUCKET).get_public_url(name)
+        cache.set(_cache_key(name), url, CACHE_TIMEOUT)
+
+    if len(_local_urls) >= MAX_LOCAL_URLS:
+        _local_urls.clear()
+    _local_urls[name] = url
+    return url
+
+
+def invalidate_public_url(name: str) -> None:
+    """Forget the public URL of an object after it was uploaded or removed"""
+    _local_urls.pop(name, None)
+    cache.delete(_cache_key(name))
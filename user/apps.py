@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UserConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "user"
+
+    def ready(self):
+        # Register the signals invalidating the cached roles of the users
+        from . import signals  # pylint: disable=import-outside-toplevel,unused-import
@@ -4,6 +4,7 @@ from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group
 from drf_spectacular.utils import extend_schema_field
+from main.permissions import ADMIN_GROUP, get_user_roles
 from .models import User
 
 
@@ -64,7 +65,7 @@ class UserReadSerializer(serializers.ModelSerializer):
     @extend_schema_field(bool)
     def get_is_admin(self, obj):
         """Return True if user is in the admin group, False otherwise."""
-        return obj.groups.filter(name="admin").exists()
+        return ADMIN_GROUP in get_user_roles(obj)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -93,7 +94,7 @@ class UserSerializer(serializers.ModelSerializer):
 
         # Add user to admin group if is_admin is True
         if is_admin:
-            admin_group = Group.objects.get(name="admin")
+            admin_group = Group.objects.get(name=ADMIN_GROUP)
             user.groups.add(admin_group)
 
         return user
@@ -106,7 +107,7 @@ class UserSerializer(serializers.ModelSerializer):
         # Update user groups if is_admin was included in the request
         if "is_admin" in validated_data:
             is_admin = validated_data.pop("is_admin", None)
-            admin_group = Group.objects.get(name="admin")
+            admin_group = Group.objects.get(name=ADMIN_GROUP)
             if is_admin:
                 instance.groups.add(admin_group)
             else:
@@ -0,0 +1,57 @@
+"""
+Signals invalidating the cached roles and token claims of the users (see
+main.permissions) whenever their groups, staff or active status change, from
+the API, the Django admin or any other ORM write.
+"""
+
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from main.permissions import invalidate_roles, invalidate_user_roles
+from .models import User
+
+# User fields carried by the roles and token claims
+ROLE_FIELDS = {"is_active", "is_staff", "is_superuser"}
+
+
+def invalidate_saved_user_roles(sender, instance, created, update_fields, **kwargs):
+    """Invalidate the roles of an updated user, unless only other fields were saved"""
+    if created or (update_fields is not None and not ROLE_FIELDS & set(update_fields)):
+        return
+    invalidate_user_roles(instance)
+
+
+def invalidate_group_members_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate the roles of the users whose groups changed"""
+    if not reverse:
+        # The groups of a user were changed
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_user_roles(instance)
+        return
+    # The users of a group were changed, a clear has to read them beforehand
+    if action == "pre_clear":
+        instance._cleared_user_ids = list(instance.user_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        for user_id in pk_set:
+            invalidate_roles(user_id)
+    elif action == "post_clear":
+        for user_id in instance.__dict__.pop("_cleared_user_ids", []):
+            invalidate_roles(user_id)
+
+
+def invalidate_deleted_group_roles(sender, instance, **kwargs):
+    """Invalidate the roles of the users of a group being deleted"""
+    for user_id in instance.user_set.values_list("pk", flat=True):
+        invalidate_roles(user_id)
+
+
+post_save.connect(
+    invalidate_saved_user_roles, sender=User, dispatch_uid="user_roles_post_save"
+)
+m2m_changed.connect(
+    invalidate_group_members_roles,
+    sender=User.groups.through,
+    dispatch_uid="user_roles_m2m_changed",
+)
+pre_delete.connect(
+    invalidate_deleted_group_roles, sender=Group, dispatch_uid="user_roles_pre_delete_Group"
+)
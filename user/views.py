@@ -12,7 +12,7 @@ from rest_framework import status
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError as RestValidationError
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from main.authentication import ClaimsJWTAuthentication
 from main.permissions import IsActive, IsSameUserOrStaff, IsInAdminGroupOrStaff
 from .models import User
 from .serializers import (
@@ -28,7 +28,7 @@ transaction_logger = logging.getLogger("transactions")
 class UserListCreateView(generics.GenericAPIView):
     """Create and Read Users"""
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsInAdminGroupOrStaff]
 
     def get_serializer_class(self):
@@ -60,7 +60,7 @@ class UserListCreateView(generics.GenericAPIView):
 class UserDetailView(generics.GenericAPIView):
     """Read and Update User(id)"""
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive, IsSameUserOrStaff]
 
     def get_serializer_class(self):
@@ -113,7 +113,7 @@ class UserMeDetails(generics.RetrieveAPIView):
     """Read User(me)"""
 
     serializer_class = UserReadSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsActive]
 
     def get_object(self):
@@ -0,0 +1,70 @@
+"""
+Row counters of the big tables kept in the cache.
+
+Counting the rows of a large table scans it on PostgreSQL, instead the
+counters are bumped when rows are created or deleted (once the transaction
+commits) and reconciled with an exact COUNT(*) when they are missing, expire
+or by the dailycheck command.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+# Seconds before a counter is recounted, in case some write bypassed it
+ROW_COUNT_TTL = 60 * 60 * 24
+
+tracked_models = []
+
+
+def get_row_count_key(model) -> str:
+    return f"row_count_{model._meta.label_lower}"
+
+
+def reconcile_row_count(model) -> int:
+    """Count the rows of the table and store the result as its counter"""
+    count = model._default_manager.count()
+    cache.set(get_row_count_key(model), count, ROW_COUNT_TTL)
+    return count
+
+
+def get_row_count(model) -> int:
+    """Number of rows of a tracked table, without touching it when cached"""
+    count = cache.get(get_row_count_key(model))
+    if count is None:
+        count = reconcile_row_count(model)
+    return count
+
+
+def bump_row_count(model, delta) -> None:
+    """Add delta to the counter of a table once the transaction commits"""
+
+    def bump():
+        try:
+            cache.incr(get_row_count_key(model), delta)
+        except ValueError:
+            # Missing counters are recounted on the next read
+            pass
+
+    transaction.on_commit(bump)
+
+
+def count_created(sender, instance, created, **kwargs):
+    if created:
+        bump_row_count(sender, 1)
+
+
+def count_deleted(sender, instance, **kwargs):
+    bump_row_count(sender, -1)
+
+
+def track_row_count(model) -> None:
+    """Keep the counter of a table up to date on every save and delete"""
+    if model not in tracked_models:
+        tracked_models.append(model)
+    post_save.connect(
+        count_created, sender=model, dispatch_uid=f"row_count_post_save_{model.__name__}"
+    )
+    post_delete.connect(
+        count_deleted, sender=model, dispatch_uid=f"row_count_post_delete_{model.__name__}"
+    )
@@ -0,0 +1,28 @@
+from django.db import connection
+from django.db.models import IntegerField, Subquery
+
+
+class SubqueryCount(Subquery):
+    """Count the rows of a subquery without grouping the outer query"""
+
+    template = "(SELECT COUNT(*) FROM (%(subquery)s) _count)"
+    output_field = IntegerField()
+
+
+def estimate_count(model) -> int:
+    """
+    Approximate number of rows of a model's table. On PostgreSQL the planner
+    estimate is read from pg_class instead of scanning the table, other
+    databases fall back to an exact COUNT(*).
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 for tables that have never been analyzed
+        if row is not None and row[0] >= 0:
+            return row[0]
+    return model._default_manager.count()
@@ -0,0 +1,68 @@
+"""
+Request coalescing (singleflight) for the hot DRF list views.
+
+Identical concurrent GET requests (same URL and authentication class) are
+served by a single computation: the first request takes a lock in the cache
+and renders the response, the others wait for the result it shares through
+the cache instead of rendering it again. As the lock lives in the cache it
+coalesces the requests of every server process.
+"""
+
+import hashlib
+import time
+import uuid
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+# Seconds a computation may hold the lock, waiters give up after it
+LOCK_TIMEOUT = 10
+# Seconds the shared result is kept for the waiters
+RESULT_TIMEOUT = 5
+# Seconds between each look for the shared result
+POLL_INTERVAL = 0.01
+
+
+class SingleflightMixin:
+    """
+    Coalesce the concurrent identical list requests of a view. Only use it on
+    views whose response depends just on the URL and whether the request is
+    authenticated, not on the user.
+    """
+
+    def get_singleflight_key(self) -> str:
+        authenticator = getattr(self.request, "successful_authenticator", None)
+        auth = type(authenticator).__name__ if authenticator else "anonymous"
+        path = hashlib.md5(self.request.get_full_path().encode()).hexdigest()
+        return f"singleflight_{auth}_{path}"
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_singleflight_key()
+        lock_key = f"{key}_lock"
+        token = uuid.uuid4().hex
+
+        if not cache.add(lock_key, token, LOCK_TIMEOUT):
+            # Another request is computing the response, wait for its result
+            leader = cache.get(lock_key)
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while leader is not None and time.monotonic() < deadline:
+                data = cache.get(f"{key}_result_{leader}")
+                if data is not None:
+                    return Response(data)
+                time.sleep(POLL_INTERVAL)
+                if cache.get(lock_key) != leader:
+                    # The computation ended, it may have been an error
+                    data = cache.get(f"{key}_result_{leader}")
+                    if data is not None:
+                        return Response(data)
+                    break
+            return super().list(request, *args, **kwargs)
+
+        try:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(f"{key}_result_{token}", response.data, RESULT_TIMEOUT)
+            return response
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
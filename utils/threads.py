@@ -0,0 +1,24 @@
+"""
+Helpers for the work run in background threads.
+
+Django closes the database connections of the request workers when each
+request finishes, but threads started by the app (thread pools, executors)
+don't go through the request cycle, so the connections they open would stay
+open until the database drops them.
+"""
+
+from functools import wraps
+from django.db import close_old_connections
+
+
+def closes_connections(func):
+    """Close the database connections of the thread once func returns"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
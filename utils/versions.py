@@ -0,0 +1,96 @@
+"""
+Version stamps of the API resources and a cache of their rendered responses.
+
+A resource version is bumped whenever its data changes (once the transaction
+commits). Views using VersionedCacheMixin keep their rendered GET responses
+in the cache under the current version and answer conditional requests
+(If-None-Match) with 304 while the version is unchanged, without rendering
+the response nor touching the database.
+"""
+
+import time
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_version_key(resource) -> str:
+    return f"resource_version_{resource}"
+
+
+def get_resource_version(resource) -> int:
+    """
+    Current version of a resource. Read it before the data it stamps: a write
+    committed in between bumps it afterwards, so the stamped data is never
+    older than its version and is refreshed on the next read
+    """
+    key = get_version_key(resource)
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time so a flushed cache never repeats versions
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_resource_version(resource) -> None:
+    """Bump the version of a resource once the transaction commits"""
+
+    def bump():
+        try:
+            cache.incr(get_version_key(resource))
+        except ValueError:
+            get_resource_version(resource)
+
+    transaction.on_commit(bump)
+
+
+class VersionedCacheMixin:
+    """
+    Cache the rendered list and detail responses of a view by the version of
+    its resource, with ETag support
+
+    cache_resource: Name of the resource whose version stamps the responses
+    cache_timeout: Seconds a rendered response is kept, it bounds the
+      staleness of data changed without bumping the version
+    """
+
+    cache_resource = None
+    cache_timeout = 60 * 5
+
+    def get_cache_variant(self) -> str:
+        """Responses are kept separately for each serializer variant"""
+        return "authenticated" if self.request.user.is_authenticated else "public"
+
+    def get_cached_response(self, render, name) -> Response:
+        version = get_resource_version(self.cache_resource)
+        variant = self.get_cache_variant()
+        etag = f'"{self.cache_resource}-{name}-{variant}-{version}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if etag in parse_etags(self.request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        key = f"response_{self.cache_resource}_{name}_{variant}_{version}"
+        data = cache.get(key)
+        if data is None:
+            response = render()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(key, data, self.cache_timeout)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            lambda: super(VersionedCacheMixin, self).list(request, *args, **kwargs),
+            "list",
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            lambda: super(VersionedCacheMixin, self).retrieve(request, *args, **kwargs),
+            f"detail_{kwargs.get(self.lookup_url_kwarg or self.lookup_field)}",
+        )